@@ -6,11 +6,18 @@ Copyright © 2018 Jean-Christophe Bos & HC² (www.hc2.fr)
 
 from    json        import loads, dumps
 from    os          import stat
+from    time        import time
 from    _thread     import start_new_thread
 import  socket
+import  select
 import  gc
 import  re
 
+try :
+    import uasyncio as asyncio
+except :
+    import asyncio
+
 try :
     from microWebTemplate import MicroWebTemplate
 except :
@@ -22,12 +29,13 @@ except :
     pass
 
 class MicroWebSrvRoute :
-    def __init__(self, route, method, func, routeArgNames, routeRegex) :
+    def __init__(self, route, method, func, routeArgNames, routeRegex, index=0) :
         self.route         = route        
         self.method        = method       
         self.func          = func         
         self.routeArgNames = routeArgNames
         self.routeRegex    = routeRegex   
+        self.index         = index        # Registration order, first match wins
 
 
 class MicroWebSrv :
@@ -80,6 +88,9 @@ class MicroWebSrv :
 
     _pyhtmlPagesExt = '.pyhtml'
 
+    # Route segments containing these characters are matched by regex only
+    _regexChars = '\\^$*+?{}[]|()'
+
     # ============================================================================
     # ===( Class globals  )=======================================================
     # ============================================================================
@@ -161,6 +172,20 @@ class MicroWebSrv :
     def _isPyHTMLFile(filename) :
         return filename.lower().endswith(MicroWebSrv._pyhtmlPagesExt)
 
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _pollKey(sock) :
+        # MicroPython poll() reports socket objects, CPython reports fds
+        return sock if hasattr(sock, 'readline') else sock.fileno()
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _isCoroutine(obj) :
+        # MicroPython coroutines are generators, both have send()
+        return hasattr(obj, 'send') and hasattr(obj, 'throw')
+
     # ============================================================================
     # ===( Constructor )==========================================================
     # ============================================================================
@@ -175,14 +200,34 @@ class MicroWebSrv :
         self._webPath       = webPath
         self._notFoundUrl   = None
         self._started       = False
+        self._stopping      = False
+        self._keptAlive     = { }
+        self._asyncServer   = None
 
         self.MaxWebSocketRecvLen        = 1024
         self.WebSocketThreaded          = True
         self.AcceptWebSocketCallback    = None
         self.LetCacheStaticContentLevel = 2
+        self.KeepAlive                  = False
+        self.KeepAliveTimeout           = 15
+        self.KeepAliveMaxRequests       = 100
+        self.KeepAliveMaxDrain          = 4096
+        self.RequestTimeout             = 2
+        self.MaxAsyncContentLength      = 16384
+        self.StaticBufferSize           = 1024
+        self.ETagManifest               = None   # JSON file of path -> content hash
+        self._etags                     = None
+        self._fileBuf                   = None
 
         self._routeHandlers = []
-        routeHandlers += self._docoratedRouteHandlers
+        # Compiled dispatch: exact (method, path) lookup, a trie of path
+        # segments for routes with <args>, and regexes for anything else.
+        # A trie node is [literal children, <arg> child, {method: route}].
+        self._exactRoutes   = { }
+        self._routeTrie     = [ { }, None, { } ]
+        self._regexRoutes   = [ ]
+        # Never extend the caller's list (or the shared default argument)
+        routeHandlers = list(routeHandlers) + self._docoratedRouteHandlers
         for route, method, func in routeHandlers :
             routeParts = route.split('/')
             # -> ['', 'users', '<uID>', 'addresses', '<addrID>', 'test', '<anotherID>']
@@ -198,24 +243,186 @@ class MicroWebSrv :
             # -> '/users/(\w*)/addresses/(\w*)/test/(\w*)$'
             routeRegex = re.compile(routeRegex)
 
-            self._routeHandlers.append(MicroWebSrvRoute(route, method, func, routeArgNames, routeRegex))
+            rh = MicroWebSrvRoute(route, method, func, routeArgNames, routeRegex, len(self._routeHandlers))
+            self._compileRoute(rh, [s for s in routeParts if s])
+            self._routeHandlers.append(rh)
+
+    # ----------------------------------------------------------------------------
+
+    def _compileRoute(self, rh, parts) :
+        for s in parts :
+            for c in s :
+                if c in self._regexChars :
+                    self._regexRoutes.append(rh)
+                    return
+        if not rh.routeArgNames :
+            path = ''.join('/' + s for s in parts)
+            for other in self._routeHandlers :
+                # An earlier route with <args> or a regex matching this
+                # exact path wins
+                if other.method == rh.method and \
+                   (other.routeArgNames or other in self._regexRoutes) and \
+                   other.routeRegex.match(path) :
+                    return
+            if (rh.method, path) not in self._exactRoutes :
+                self._exactRoutes[(rh.method, path)] = rh
+            return
+        node = self._routeTrie
+        for s in parts :
+            if s.startswith('<') and s.endswith('>') :
+                if node[1] is None :
+                    node[1] = [ { }, None, { } ]
+                node = node[1]
+            else :
+                child = node[0].get(s)
+                if child is None :
+                    child = node[0][s] = [ { }, None, { } ]
+                node = child
+        if rh.method not in node[2] :
+            node[2][rh.method] = rh
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _isWord(s) :
+        # Same as the (\w*) group of the route regex
+        for c in s :
+            if not (c.isalpha() or c.isdigit() or c == '_') :
+                return False
+        return True
+
+    # ----------------------------------------------------------------------------
+
+    def _matchTrie(self, node, segs, i, method, values) :
+        # Returns (route, arg values) of the earliest registered match, or None
+        if i == len(segs) :
+            rh = node[2].get(method)
+            return (rh, values[:]) if rh else None
+        best  = None
+        child = node[0].get(segs[i])
+        if child :
+            best = self._matchTrie(child, segs, i+1, method, values)
+        if node[1] and MicroWebSrv._isWord(segs[i]) :
+            values.append(segs[i])
+            found = self._matchTrie(node[1], segs, i+1, method, values)
+            values.pop()
+            if found and (best is None or found[0].index < best[0].index) :
+                best = found
+        return best
 
     # ============================================================================
     # ===( Server Process )=======================================================
     # ============================================================================
 
     def _serverProcess(self) :
-        self._started = True
-        while True :
+        self._started  = True
+        self._stopping = False
+        srvKey = MicroWebSrv._pollKey(self._server)
+        poller = select.poll()
+        poller.register(self._server, select.POLLIN)
+        while not self._stopping :
             try :
-                client, cliAddr = self._server.accept()
-            except Exception as ex :
-                if ex.args and ex.args[0] == 113 :
-                    break
-                continue
-            self._client(self, client, cliAddr)
+                events = poller.poll(1000)
+            except Exception :
+                break
+            for obj, ev in events :
+                if obj == srvKey or obj is self._server :
+                    try :
+                        client, cliAddr = self._server.accept()
+                    except Exception as ex :
+                        if self._stopping or (ex.args and ex.args[0] == 113) :
+                            self._stopping = True
+                            break
+                        continue
+                    self._serveConnection(poller, client, cliAddr, None)
+                else :
+                    conn = self._keptAlive.pop(obj, None)
+                    if conn :
+                        poller.unregister(conn[0])
+                        self._serveConnection(poller, conn[0], conn[1], conn[2], conn[4])
+            self._closeIdleConnections(poller)
+        for conn in self._keptAlive.values() :
+            MicroWebSrv._closeConnection(conn[0], conn[2])
+        self._keptAlive = { }
         self._started = False
 
+    # ----------------------------------------------------------------------------
+
+    def _serveConnection(self, poller, sock, addr, sockfile, served=0) :
+        while True :
+            served += 1
+            client = self._client(self, sock, addr, sockfile, served)
+            if not client._keepAlive :
+                return
+            sockfile = client._socketfile
+            # Pipelined requests already received are answered in order
+            if not self._requestPending(sock, sockfile) :
+                break
+        # Wait for the next request on this socket along with new clients
+        self._keptAlive[MicroWebSrv._pollKey(sock)] = (sock, addr, sockfile, time(), served)
+        poller.register(sock, select.POLLIN)
+
+    # ----------------------------------------------------------------------------
+
+    def _requestPending(self, sock, sockfile) :
+        try :
+            if sockfile is not sock :
+                # CPython may already hold the next request in its read buffer
+                sock.settimeout(0)
+                try :
+                    return len(sockfile.peek(1)) > 0
+                finally :
+                    sock.settimeout(self.RequestTimeout)
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            return len(poller.poll(0)) > 0
+        except :
+            return False
+
+    # ----------------------------------------------------------------------------
+
+    def _closeIdleConnections(self, poller) :
+        now = time()
+        for key in list(self._keptAlive) :
+            conn = self._keptAlive[key]
+            if now - conn[3] >= self.KeepAliveTimeout :
+                del self._keptAlive[key]
+                poller.unregister(conn[0])
+                MicroWebSrv._closeConnection(conn[0], conn[2])
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _closeConnection(sock, sockfile) :
+        try :
+            if sockfile is not sock :
+                sockfile.close()
+            sock.close()
+        except :
+            pass
+
+    # ----------------------------------------------------------------------------
+
+    async def _serveAsync(self, reader, writer) :
+        try :
+            addr = writer.get_extra_info('peername')
+        except :
+            addr = None
+        try :
+            served = 0
+            while not self._stopping :
+                served += 1
+                client = MicroWebSrv._asyncClient(self, reader, writer, addr, served)
+                if not await client._processRequestAsync() :
+                    break
+        except Exception as ex :
+            print('MicroWebSrv async connection error: %s' % ex)
+        try :
+            writer.close()
+            await writer.wait_closed()
+        except :
+            pass
+
     # ============================================================================
     # ===( Functions )============================================================
     # ============================================================================
@@ -235,9 +442,27 @@ class MicroWebSrv :
 
     # ----------------------------------------------------------------------------
 
+    async def StartAsync(self) :
+        """ Serves on the running asyncio loop; route handlers may be coroutines """
+        if not self._started :
+            self._stopping    = False
+            self._asyncServer = await asyncio.start_server( self._serveAsync,
+                                                            self._srvAddr[0],
+                                                            self._srvAddr[1],
+                                                            backlog=16 )
+            self._started     = True
+
+    # ----------------------------------------------------------------------------
+
     def Stop(self) :
         if self._started :
-            self._server.close()
+            self._stopping = True
+            if self._asyncServer :
+                self._asyncServer.close()
+                self._asyncServer = None
+                self._started     = False
+            else :
+                self._server.close()
 
     # ----------------------------------------------------------------------------
 
@@ -266,22 +491,33 @@ class MicroWebSrv :
             if resUrl.endswith('/') :
                 resUrl = resUrl[:-1]
             method = method.upper()
-            for rh in self._routeHandlers :
-                if rh.method == method :
+            rh = self._exactRoutes.get((method, resUrl))
+            if rh :
+                return (rh.func, None)
+            found = None
+            segs  = resUrl.split('/')
+            if segs[0] == '' :
+                found = self._matchTrie(self._routeTrie, segs, 1, method, [])
+            for rh in self._regexRoutes :
+                if rh.method == method and (found is None or rh.index < found[0].index) :
                     m = rh.routeRegex.match(resUrl)
-                    if m :   # found matching route?
-                        if rh.routeArgNames :
-                            routeArgs = {}
-                            for i, name in enumerate(rh.routeArgNames) :
-                                value = m.group(i+1)
-                                try :
-                                    value = int(value)
-                                except :
-                                    pass
-                                routeArgs[name] = value
-                            return (rh.func, routeArgs)
-                        else :
-                            return (rh.func, None)
+                    if m :
+                        found = (rh, [m.group(i+1) for i in range(len(rh.routeArgNames))])
+                        break
+            if found :
+                rh, values = found
+                if rh.routeArgNames :
+                    routeArgs = {}
+                    for i, name in enumerate(rh.routeArgNames) :
+                        value = values[i]
+                        try :
+                            value = int(value)
+                        except :
+                            pass
+                        routeArgs[name] = value
+                    return (rh.func, routeArgs)
+                else :
+                    return (rh.func, None)
         return (None, None)
 
     # ----------------------------------------------------------------------------
@@ -298,6 +534,70 @@ class MicroWebSrv :
                 return physPath
         return None
 
+    # ----------------------------------------------------------------------------
+
+    def _fileBuffer(self) :
+        # One buffer serves every static file. A chunk is always read and
+        # written out before the next one, even between async drains.
+        if self._fileBuf is None or len(self._fileBuf) != self.StaticBufferSize :
+            self._fileBuf = bytearray(self.StaticBufferSize)
+        return self._fileBuf
+
+    # ----------------------------------------------------------------------------
+
+    def GetETag(self, filepath) :
+        # Content hash from the manifest written at install time, otherwise
+        # a weak tag from the file size and modification time
+        if self._etags is None :
+            self._etags = { }
+            if self.ETagManifest :
+                try :
+                    with open(self.ETagManifest, 'r') as f :
+                        for path, tag in loads(f.read()).items() :
+                            self._etags[MicroWebSrv._etagKey(path)] = tag
+                except :
+                    pass
+        tag = self._etags.get(MicroWebSrv._etagKey(filepath))
+        if tag :
+            return '"%s"' % tag
+        try :
+            st = stat(filepath)
+            return 'W/"%x-%x"' % (st[6], int(st[8]))
+        except :
+            return None
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _etagKey(path) :
+        # Manifest paths are relative to the filesystem root, as OTA writes
+        # them ("www/index.html"); webPath must then be "/www" or "www"
+        while path.startswith('./') :
+            path = path[2:]
+        return path.lstrip('/')
+
+    # ----------------------------------------------------------------------------
+
+    def ReloadETags(self) :
+        self._etags = None
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _etagMatches(ifNoneMatch, etag) :
+        # Weak comparison, as required for If-None-Match
+        if ifNoneMatch.strip() == '*' :
+            return True
+        if etag.startswith('W/') :
+            etag = etag[2:]
+        for tag in ifNoneMatch.split(',') :
+            tag = tag.strip()
+            if tag.startswith('W/') :
+                tag = tag[2:]
+            if tag == etag :
+                return True
+        return False
+
     # ============================================================================
     # ===( Class Client  )========================================================
     # ============================================================================
@@ -306,11 +606,26 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def __init__(self, microWebSrv, socket, addr) :
-            socket.settimeout(2)
+        def __init__(self, microWebSrv, socket, addr, socketfile=None, requestNo=1) :
+            socket.settimeout(microWebSrv.RequestTimeout)
+            self._init(microWebSrv, socket, addr, requestNo)
+
+            if socketfile :   # Kept-alive connection
+                self._socketfile = socketfile
+            elif hasattr(socket, 'readline'):   # MicroPython
+                self._socketfile = self._socket
+            else:   # CPython
+                self._socketfile = self._socket.makefile('rwb')
+
+            self._processRequest()
+
+        # ------------------------------------------------------------------------
+
+        def _init(self, microWebSrv, socket, addr, requestNo) :
             self._microWebSrv   = microWebSrv
             self._socket        = socket
             self._addr          = addr
+            self._requestNo     = requestNo   # Position on a kept-alive connection
             self._method        = None
             self._path          = None
             self._httpVer       = None
@@ -320,78 +635,129 @@ class MicroWebSrv :
             self._headers       = { }
             self._contentType   = None
             self._contentLength = 0
-            
-            if hasattr(socket, 'readline'):   # MicroPython
-                self._socketfile = self._socket
-            else:   # CPython
-                self._socketfile = self._socket.makefile('rwb')
-                        
-            self._processRequest()
+            self._contentRead   = 0
+            self._keepAlive     = False
+            self._upgraded      = False
 
         # ------------------------------------------------------------------------
 
         def _processRequest(self) :
+            response = MicroWebSrv._response(self)
             try :
-                response = MicroWebSrv._response(self)
-                if self._parseFirstLine(response) :
-                    if self._parseHeader(response) :
-                        upg = self._getConnUpgrade()
-                        if not upg :
-                            routeHandler, routeArgs = self._microWebSrv.GetRouteHandler(self._resPath, self._method)
-                            if routeHandler :
-                                try :
-                                    if routeArgs is not None:
-                                        routeHandler(self, response, routeArgs)
-                                    else :
-                                        routeHandler(self, response)
-                                except Exception as ex :
-                                    print('MicroWebSrv handler exception:\r\n  - In route %s %s\r\n  - %s' % (self._method, self._resPath, ex))
-                                    raise ex
-                            elif self._method.upper() == "GET" :
-                                filepath = self._microWebSrv._physPathFromURLPath(self._resPath)
-                                if filepath :
-                                    if MicroWebSrv._isPyHTMLFile(filepath) :
-                                        response.WriteResponsePyHTMLFile(filepath)
-                                    else :
-                                        contentType = self._microWebSrv.GetMimeTypeFromFilename(filepath)
-                                        if contentType :
-                                            if self._microWebSrv.LetCacheStaticContentLevel > 0 :
-                                                if self._microWebSrv.LetCacheStaticContentLevel > 1 and \
-                                                   'if-modified-since' in self._headers :
-                                                    response.WriteResponseNotModified()
-                                                else:
-                                                    headers = { 'Last-Modified' : 'Fri, 1 Jan 2018 23:42:00 GMT', \
-                                                                'Cache-Control' : 'max-age=315360000' }
-                                                    response.WriteResponseFile(filepath, contentType, headers)
-                                            else :
-                                                response.WriteResponseFile(filepath, contentType)
-                                        else :
-                                            response.WriteResponseForbidden()
-                                else :
-                                    response.WriteResponseNotFound()
-                            else :
-                                response.WriteResponseMethodNotAllowed()
-                        elif upg == 'websocket' and 'MicroWebSocket' in globals() \
-                             and self._microWebSrv.AcceptWebSocketCallback :
-                                MicroWebSocket( socket         = self._socket,
-                                                httpClient     = self,
-                                                httpResponse   = response,
-                                                maxRecvLen     = self._microWebSrv.MaxWebSocketRecvLen,
-                                                threaded       = self._microWebSrv.WebSocketThreaded,
-                                                acceptCallback = self._microWebSrv.AcceptWebSocketCallback )
-                                return
-                        else :
-                            response.WriteResponseNotImplemented()
-                    else :
-                        response.WriteResponseBadRequest()
+                result = self._handleRequest(response)
+                if MicroWebSrv._isCoroutine(result) :
+                    result.close()
+                    raise Exception('Async route handlers need StartAsync()')
             except :
+                self._keepAlive = False
                 response.WriteResponseInternalServerError()
+            if self._upgraded :
+                return   # The WebSocket owns the socket now
+            if self._keepAlive and self._contentRead < self._contentLength :
+                # Unread body would be parsed as the next request
+                self._keepAlive = self._drainContent()
+            if self._keepAlive :
+                try :
+                    if self._socketfile is not self._socket :
+                        self._socketfile.flush()   # CPython buffers the response
+                    return   # The server keeps the socket for the next request
+                except :
+                    pass
+            MicroWebSrv._closeConnection(self._socket, self._socketfile)
+
+        # ------------------------------------------------------------------------
+
+        def _drainContent(self) :
+            # Skips a small unread body so the connection can be reused
+            size = self._contentLength - self._contentRead
+            if size > self._microWebSrv.KeepAliveMaxDrain :
+                return False
             try :
-                if self._socketfile is not self._socket:
-                    self._socketfile.close()
-                self._socket.close()
+                while size > 0 :
+                    data = self._socketfile.read(min(size, 512))
+                    if not data :
+                        return False
+                    size -= len(data)
+                return True
             except :
-                pass
+                return False
+
+        # ------------------------------------------------------------------------
+
+        def _handleRequest(self, response) :
+            # Returns the route handler result, which is awaited in async mode
+            if self._parseFirstLine(response) :
+                if self._parseHeader(response) :
+                    upg = self._getConnUpgrade()
+                    if not upg :
+                        routeHandler, routeArgs = self._microWebSrv.GetRouteHandler(self._resPath, self._method)
+                        if routeHandler :
+                            try :
+                                if routeArgs is not None:
+                                    return routeHandler(self, response, routeArgs)
+                                else :
+                                    return routeHandler(self, response)
+                            except Exception as ex :
+                                print('MicroWebSrv handler exception:\r\n  - In route %s %s\r\n  - %s' % (self._method, self._resPath, ex))
+                                raise ex
+                        elif self._method.upper() == "GET" :
+                            filepath = self._microWebSrv._physPathFromURLPath(self._resPath)
+                            if filepath :
+                                if MicroWebSrv._isPyHTMLFile(filepath) :
+                                    response.WriteResponsePyHTMLFile(filepath)
+                                else :
+                                    contentType = self._microWebSrv.GetMimeTypeFromFilename(filepath)
+                                    if contentType :
+                                        return self._serveStaticFile(response, filepath, contentType)
+                                    else :
+                                        response.WriteResponseForbidden()
+                            else :
+                                response.WriteResponseNotFound()
+                        else :
+                            response.WriteResponseMethodNotAllowed()
+                    elif upg == 'websocket' and 'MicroWebSocket' in globals() \
+                         and self._microWebSrv.AcceptWebSocketCallback \
+                         and self._socket is not None :
+                            self._keepAlive = False
+                            self._upgraded  = True
+                            MicroWebSocket( socket         = self._socket,
+                                            httpClient     = self,
+                                            httpResponse   = response,
+                                            maxRecvLen     = self._microWebSrv.MaxWebSocketRecvLen,
+                                            threaded       = self._microWebSrv.WebSocketThreaded,
+                                            acceptCallback = self._microWebSrv.AcceptWebSocketCallback )
+                    else :
+                        response.WriteResponseNotImplemented()
+                else :
+                    response.WriteResponseBadRequest()
+            return None
+
+        # ------------------------------------------------------------------------
+
+        def _serveStaticFile(self, response, filepath, contentType) :
+            # Returns a coroutine in async mode, so the file is streamed with drains
+            srv     = self._microWebSrv
+            headers = { }
+            if MicroWebSrv._fileExists(filepath + '.gz') :
+                # Precompressed sibling, e.g. style.css.gz next to style.css
+                headers['Vary'] = 'Accept-Encoding'
+                if 'gzip' in self._headers.get('accept-encoding', '') :
+                    filepath += '.gz'
+                    headers['Content-Encoding'] = 'gzip'
+            if srv.LetCacheStaticContentLevel > 0 :
+                etag = srv.GetETag(filepath)
+                if etag :
+                    headers['ETag'] = etag
+                    # Cache, but revalidate so an update is seen at once
+                    headers['Cache-Control'] = 'no-cache'
+                    if srv.LetCacheStaticContentLevel > 1 and \
+                       MicroWebSrv._etagMatches(self._headers.get('if-none-match', ''), etag) :
+                        response.WriteResponseNotModified(headers)
+                        return None
+            if self._socket is None :
+                return response.WriteResponseFileAsync(filepath, contentType, headers)
+            response.WriteResponseFile(filepath, contentType, headers)
+            return None
 
         # ------------------------------------------------------------------------
 
@@ -426,15 +792,28 @@ class MicroWebSrv :
                 if len(elements) == 2 :
                     self._headers[elements[0].strip().lower()] = elements[1].strip()
                 elif len(elements) == 1 and len(elements[0]) == 0 :
-                    if self._method == 'POST' or self._method == 'PUT' :
-                        self._contentType   = self._headers.get("content-type", None)
-                        self._contentLength = int(self._headers.get("content-length", 0))
+                    # Any method may carry a body, which must be consumed
+                    # before the next request on a kept-alive connection
+                    self._contentType   = self._headers.get("content-type", None)
+                    self._contentLength = int(self._headers.get("content-length", 0))
+                    self._keepAlive = self._wantsKeepAlive()
                     return True
                 else :
                     return False
 
         # ------------------------------------------------------------------------
 
+        def _wantsKeepAlive(self) :
+            if not self._microWebSrv.KeepAlive or \
+               self._requestNo >= self._microWebSrv.KeepAliveMaxRequests :
+                return False
+            conn = self._headers.get('connection', '').lower()
+            if self._httpVer == 'HTTP/1.1' :
+                return 'close' not in conn
+            return 'keep-alive' in conn
+
+        # ------------------------------------------------------------------------
+
         def _getConnUpgrade(self) :
             if 'upgrade' in self._headers.get('connection', '').lower() :
                 return self._headers.get('upgrade', '').lower()
@@ -507,7 +886,9 @@ class MicroWebSrv :
                 size = self._contentLength
             if size > 0 :
                 try :
-                    return self._socketfile.read(size)
+                    data = self._socketfile.read(size)
+                    self._contentRead += len(data)
+                    return data
                 except :
                     pass
             return b''
@@ -537,6 +918,117 @@ class MicroWebSrv :
                     pass
             return None
         
+    # ============================================================================
+    # ===( Class Async Client  )==================================================
+    # ============================================================================
+
+    class _asyncSocketFile :
+
+        # Serves the read-ahead request bytes to the request parser and sends
+        # the response to the stream writer, which is drained after the request
+
+        # ------------------------------------------------------------------------
+
+        def __init__(self, data, writer) :
+            self._data   = data
+            self._pos    = 0
+            self._writer = writer
+
+        # ------------------------------------------------------------------------
+
+        def readline(self) :
+            end = self._data.find(b'\n', self._pos)
+            end = len(self._data) if end < 0 else end + 1
+            line = self._data[self._pos:end]
+            self._pos = end
+            return line
+
+        # ------------------------------------------------------------------------
+
+        def read(self, size=-1) :
+            end = len(self._data)
+            if size >= 0 :
+                end = min(self._pos + size, end)
+            data = self._data[self._pos:end]
+            self._pos = end
+            return data
+
+        # ------------------------------------------------------------------------
+
+        def write(self, data) :
+            # The stream writer copies whatever it cannot send at once, so
+            # data (often a view of the shared file buffer) is passed as is
+            self._writer.write(data)
+            return len(data)
+
+    # ============================================================================
+
+    class _asyncClient(_client) :
+
+        # ------------------------------------------------------------------------
+
+        def __init__(self, microWebSrv, reader, writer, addr, requestNo=1) :
+            self._init(microWebSrv, None, addr, requestNo)
+            self._reader     = reader
+            self._writer     = writer
+            self._socketfile = MicroWebSrv._asyncSocketFile(b'', writer)
+
+        # ------------------------------------------------------------------------
+
+        async def _readAhead(self) :
+            # Reads the request line, headers and body without blocking the loop.
+            # Pipelined requests stay buffered in the reader until their turn.
+            srv     = self._microWebSrv
+            timeout = srv.RequestTimeout if self._requestNo == 1 else srv.KeepAliveTimeout
+            line    = await asyncio.wait_for(self._reader.readline(), timeout)
+            if not line :
+                return None
+            parts  = [line]
+            length = 0
+            while True :
+                line = await asyncio.wait_for(self._reader.readline(), srv.RequestTimeout)
+                if not line or len(parts) > 64 :
+                    return None
+                parts.append(line)
+                if line == b'\r\n' or line == b'\n' :
+                    break
+                if line[:15].lower() == b'content-length:' :
+                    length = int(line[15:].strip())
+            if length > srv.MaxAsyncContentLength :
+                MicroWebSrv._response(self).WriteResponseError(413)
+                return None
+            if length > 0 :
+                parts.append(await asyncio.wait_for(self._reader.readexactly(length), srv.RequestTimeout))
+            return b''.join(parts)
+
+        # ------------------------------------------------------------------------
+
+        async def _processRequestAsync(self) :
+            # Returns True if the connection stays open for the next request
+            try :
+                data = await self._readAhead()
+            except Exception :
+                data = None   # Timed out, disconnected or malformed
+            if data is not None :
+                self._socketfile = MicroWebSrv._asyncSocketFile(data, self._writer)
+                response = MicroWebSrv._response(self)
+                try :
+                    result = self._handleRequest(response)
+                    if MicroWebSrv._isCoroutine(result) :
+                        try :
+                            await result
+                        except Exception as ex :
+                            print('MicroWebSrv handler exception:\r\n  - In route %s %s\r\n  - %s' % (self._method, self._resPath, ex))
+                            raise ex
+                except :
+                    self._keepAlive = False
+                    response.WriteResponseInternalServerError()
+            try :
+                await self._writer.drain()
+            except :
+                return False
+            return data is not None and self._keepAlive
+
     # ============================================================================
     # ===( Class Response  )======================================================
     # ============================================================================
@@ -604,8 +1096,16 @@ class MicroWebSrv :
             if contentLength > 0 :
                 self._writeContentTypeHeader(contentType, contentCharset)
                 self._writeHeader("Content-Length", contentLength)
+            elif self._client._keepAlive and code != 304 :
+                self._writeHeader("Content-Length", 0)
             self._writeServerHeader()
-            self._writeHeader("Connection", "close")
+            if self._client._keepAlive :
+                srv = self._client._microWebSrv
+                self._writeHeader("Connection", "keep-alive")
+                self._writeHeader( "Keep-Alive", "timeout=%s, max=%s"
+                                   % (srv.KeepAliveTimeout, srv.KeepAliveMaxRequests - self._client._requestNo) )
+            else :
+                self._writeHeader("Connection", "close")
             self._writeEndHeader()
 
         # ------------------------------------------------------------------------
@@ -662,29 +1162,55 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def WriteResponseFile(self, filepath, contentType=None, headers=None) :
+        def _openResponseFile(self, filepath, contentType, headers) :
+            # Writes the headers and returns the open file, or None after a 404
             try :
                 size = stat(filepath)[6]
                 if size > 0 :
-                    with open(filepath, 'rb') as file :
-                        self._writeBeforeContent(200, headers, contentType, None, size)
-                        try :
-                            buf = bytearray(1024)
-                            while size > 0 :
-                                x = file.readinto(buf)
-                                if x < len(buf) :
-                                    buf = memoryview(buf)[:x]
-                                if not self._write(buf) :
-                                    return False
-                                size -= x
-                            return True
-                        except :
-                            self.WriteResponseInternalServerError()
-                            return False
+                    file = open(filepath, 'rb')
+                    self._writeBeforeContent(200, headers, contentType, None, size)
+                    return file
             except :
                 pass
             self.WriteResponseNotFound()
-            return False
+            return None
+
+        # ------------------------------------------------------------------------
+
+        def WriteResponseFile(self, filepath, contentType=None, headers=None) :
+            file = self._openResponseFile(filepath, contentType, headers)
+            if file is None :
+                return False
+            with file :
+                try :
+                    buf = memoryview(self._client._microWebSrv._fileBuffer())
+                    while True :
+                        x = file.readinto(buf)
+                        if not x :
+                            return True
+                        if not self._write(buf[:x]) :
+                            return False
+                except :
+                    self.WriteResponseInternalServerError()
+                    return False
+
+        # ------------------------------------------------------------------------
+
+        async def WriteResponseFileAsync(self, filepath, contentType=None, headers=None) :
+            # Async mode only: waits for each chunk to drain, so a large file
+            # never sits in RAM and other connections keep being served
+            file = self._openResponseFile(filepath, contentType, headers)
+            if file is None :
+                return False
+            with file :
+                buf = memoryview(self._client._microWebSrv._fileBuffer())
+                while True :
+                    x = file.readinto(buf)
+                    if not x :
+                        return True
+                    if not self._write(buf[:x]) :
+                        return False
+                    await self._client._writer.drain()
 
         # ------------------------------------------------------------------------
 
@@ -735,8 +1261,9 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def WriteResponseNotModified(self) :
-            return self.WriteResponseError(304)
+        def WriteResponseNotModified(self, headers=None) :
+            # A 304 has no body; headers carry the validators (ETag, Vary)
+            return self.WriteResponse(304, headers, None, None, None)
 
         # ------------------------------------------------------------------------
 
@@ -8,6 +8,9 @@ import ujson  # Import ujson for handling JSON data
 import gc
 import uasyncio as asyncio
 from utils import *
+from alarm_log import child_journal, mother_journal
+from identity import get_identity
+from api_calls import mother_delivery_stats
 from wifi_connect import *
 from messages import defaultDisplay
 from styles import *
@@ -50,7 +53,7 @@ def web_page_wifi(status_messages, wifi_connected, wifi_ip):
     config = load_config()
     current_ssid = config.get('ssid', '')
     current_password = config.get('password', '')
-    mac_address_string = get_mac_address()
+    mac_address_string = get_identity()['mac_address']
     
     # Temperature
     temp = read_internal_temp()
@@ -134,9 +137,7 @@ def web_page_config(status_messages):
     isMother = config.get('isMother', False)
     center_name = config.get('center_name', '')
     block_name = config.get('block_name', '')
-    last_alarm = config.get('last_alarm', [])
     number_of_rooms = config.get('number_of_rooms', '')
-    mother_alarms = config.get('mother_alarms', [])
     test_mode = config.get('test_mode', False)
     machine_code = config.get('machine_code', '')
     machine_token = config.get('machine_token', '')
@@ -150,8 +151,14 @@ def web_page_config(status_messages):
     for message in status_messages:
         status_html += f"<p>{message}</p>"
 
+    # Read the alarm journals, flagging records past the settled marker
+    mother_marker = mother_journal.marker()
+    mother_alarms = [(end > mother_marker, alarm) for end, alarm in mother_journal.records()]
+    synced_marker = child_journal.marker()
+    last_alarm = [(end <= synced_marker, alarm) for end, alarm in child_journal.records()]
+
     # Generate mother_alarms HTML table
-    if isinstance(mother_alarms, list) and mother_alarms:
+    if mother_alarms:
         mother_alarms_html = """
         <h3>Mother Alarms</h3>
         <table>
@@ -163,13 +170,13 @@ def web_page_config(status_messages):
                 <th>Ring</th>
             </tr>
         """
-        for alarm in mother_alarms:
+        for unsilenced, alarm in mother_alarms:
             if isinstance(alarm, dict):
                 room = alarm.get('room', 'N/A')
                 block = alarm.get('block_name', 'N/A')
                 date = alarm.get('date', 'N/A')
                 reference = alarm.get('reference','N/A')
-                ring = 'Yes' if alarm.get('ring', False) else 'No'
+                ring = 'Yes' if unsilenced and alarm.get('ring', False) else 'No'
                 mother_alarms_html += f"""
                     <tr>
                         <td>{room}</td>
@@ -191,7 +198,7 @@ def web_page_config(status_messages):
         mother_alarms_html = "<p>No mother alarms configured.</p>"
     
     # Generate last alarms HTML table
-    if isinstance(last_alarm, list) and last_alarm:
+    if last_alarm:
         last_alarms_html = """
         <h3>Last Alarms</h3>
         <table>
@@ -204,14 +211,17 @@ def web_page_config(status_messages):
                 <th>Sent to Mother</th>
             </tr>
         """
-        for alarm in last_alarm:
+        for synced, alarm in last_alarm:
             if isinstance(alarm, dict):
                 room = alarm.get('roomName', 'N/A')
                 date = alarm.get('alarmTime', 'N/A')
                 reference = alarm.get('reference','N/A')
                 mode = alarm.get('mode','N/A')
-                synced = alarm.get('synced','N/A')
                 status = 'Yes' if alarm.get('isSent', True) else 'No'
+                mothers = alarm.get('mothers')
+                if isinstance(mothers, dict) and mothers:
+                    delivered = len([ip for ip in mothers if mothers[ip] is not None])
+                    status += f" ({delivered}/{len(mothers)})"
                 last_alarms_html += f"""
                     <tr>
                         <td>{room}</td>
@@ -233,6 +243,44 @@ def web_page_config(status_messages):
     else:
         last_alarms_html = "<p>No last alarms configured.</p>"
 
+    # Retention counters, so sites close to losing unsynced alarms stand out
+    evictions = child_journal.stats()
+    last_alarms_html += f"""
+        <p>Stored: {child_journal.count()} |
+        Evicted (synced): {evictions.get('evicted_synced', 0)} |
+        Evicted (unsynced): {evictions.get('evicted_unsynced', 0)} |
+        Unacknowledged by cloud: {evictions.get('unacknowledged', 0)}</p>
+    """
+
+    # Delivery to each mother since boot, to spot slow or unreachable ones
+    if mother_delivery_stats:
+        last_alarms_html += """
+        <h3>Mother Delivery</h3>
+        <table>
+            <tr>
+                <th>Mother</th>
+                <th>Sent</th>
+                <th>Failed</th>
+                <th>Last (ms)</th>
+                <th>Max (ms)</th>
+                <th>Avg (ms)</th>
+            </tr>
+        """
+        for ip, stats in mother_delivery_stats.items():
+            sent = stats["sent"]
+            avg = stats["total_ms"] // sent if sent else 0
+            last_alarms_html += f"""
+                <tr>
+                    <td>{ip}</td>
+                    <td>{sent}</td>
+                    <td>{stats["failed"]}</td>
+                    <td>{stats["last_ms"]}</td>
+                    <td>{stats["max_ms"]}</td>
+                    <td>{avg}</td>
+                </tr>
+            """
+        last_alarms_html += "</table>"
+
 
 
     # Assemble the complete HTML content
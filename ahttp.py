@@ -0,0 +1,289 @@
+# ahttp.py
+
+import uasyncio as asyncio
+import ujson
+import time
+
+# Default timeouts in seconds
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 10
+
+# Idle keep-alive connections are dropped after this many seconds; keep it
+# below the server's keep-alive timeout so we never reuse a closed socket.
+POOL_IDLE_TIMEOUT = 10
+
+
+class Response:
+    """HTTP response, mirroring the parts of urequests.Response we use."""
+
+    def __init__(self, status_code, reason, headers, content):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return ujson.loads(self.content)
+
+    def close(self):
+        # The body is fully read and the socket released by request()
+        pass
+
+
+def parse_url(url):
+    """Split a URL into (use_ssl, host, port, path)."""
+    proto, _, rest = url.split('/', 2)
+    if proto == 'https:':
+        use_ssl, port = True, 443
+    elif proto == 'http:':
+        use_ssl, port = False, 80
+    else:
+        raise ValueError(f"Unsupported protocol: {proto}")
+    if '/' in rest:
+        host, path = rest.split('/', 1)
+        path = '/' + path
+    else:
+        host, path = rest, '/'
+    if ':' in host:
+        host, port = host.split(':', 1)
+        port = int(port)
+    return use_ssl, host, port, path
+
+
+class ConnectionPool:
+    """
+    Idle HTTP/1.1 keep-alive connections, keyed by (host, port, ssl).
+
+    A connection is only reused while it is younger than idle_timeout; a
+    reused connection that turns out to be dead is replaced transparently
+    by request().
+    """
+
+    def __init__(self, idle_timeout=POOL_IDLE_TIMEOUT, max_per_host=2):
+        self.idle_timeout = idle_timeout
+        self.max_per_host = max_per_host
+        self.reused = 0
+        self.opened = 0
+        self._idle = {}  # key -> list of [reader, writer, ticks_ms]
+
+    def _expired(self, ticks):
+        return time.ticks_diff(time.ticks_ms(), ticks) > self.idle_timeout * 1000
+
+    def evict_idle(self):
+        """Close every idle connection older than the idle timeout."""
+        for key in list(self._idle):
+            conns = self._idle[key]
+            for conn in conns[:]:
+                if self._expired(conn[2]):
+                    conns.remove(conn)
+                    _close(conn[1])
+            if not conns:
+                del self._idle[key]
+
+    async def acquire(self, key, connect_timeout):
+        """Return (reader, writer, reused) for key, reusing a warm socket if possible."""
+        self.evict_idle()
+        conns = self._idle.get(key)
+        if conns:
+            reader, writer, _ = conns.pop()
+            self.reused += 1
+            return reader, writer, True
+        reader, writer = await _open(key[0], key[1], key[2], connect_timeout)
+        self.opened += 1
+        return reader, writer, False
+
+    def release(self, key, reader, writer):
+        """Return a healthy connection to the pool."""
+        conns = self._idle.setdefault(key, [])
+        if len(conns) >= self.max_per_host:
+            _close(writer)
+            return
+        conns.append([reader, writer, time.ticks_ms()])
+
+    def close_all(self):
+        for key in self._idle:
+            for conn in self._idle[key]:
+                _close(conn[1])
+        self._idle = {}
+
+
+def _close(writer):
+    try:
+        writer.close()
+    except Exception:
+        pass
+
+
+async def _open(host, port, use_ssl, timeout):
+    if use_ssl:
+        connect = asyncio.open_connection(host, port, ssl=True)
+    else:
+        connect = asyncio.open_connection(host, port)
+    return await asyncio.wait_for(connect, timeout)
+
+
+async def _read_body(reader, headers, timeout):
+    length = headers.get('content-length')
+    if length is not None:
+        length = int(length)
+        return await asyncio.wait_for(reader.readexactly(length), timeout) if length else b''
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = b''
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            size = int(line.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # Skip trailers up to the final blank line
+                while (await asyncio.wait_for(reader.readline(), timeout)).strip():
+                    pass
+                return body
+            body += await asyncio.wait_for(reader.readexactly(size), timeout)
+            await asyncio.wait_for(reader.readexactly(2), timeout)  # CRLF
+    # No framing: the body runs until the server closes the connection
+    body = b''
+    while True:
+        chunk = await asyncio.wait_for(reader.read(512), timeout)
+        if not chunk:
+            return body
+        body += chunk
+
+
+async def _read_response(reader, timeout):
+    status_line = await asyncio.wait_for(reader.readline(), timeout)
+    parts = status_line.decode().strip().split(' ', 2)
+    if len(parts) < 2:
+        raise OSError(f"Invalid status line: {status_line}")
+    status_code = int(parts[1])
+    reason = parts[2] if len(parts) > 2 else ''
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if not line or line == b'\r\n':
+            break
+        line = line.decode()
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    content = await _read_body(reader, headers, timeout)
+    return Response(status_code, reason, headers, content)
+
+
+class RequestTemplate:
+    """
+    Request line and headers for one destination, encoded once.
+
+    Sending through a template only appends the Content-Length and the body,
+    so callers that hit the same URL repeatedly keep one around and rebuild
+    it only when the URL or headers change.
+    """
+
+    def __init__(self, method, url, headers=None, keep_alive=False):
+        self.url = url
+        use_ssl, host, port, path = parse_url(url)
+        self.host = host
+        self.key = (host, port, use_ssl)
+        self.keep_alive = keep_alive
+        head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+        if headers:
+            for name in headers:
+                if name.lower() not in ('host', 'content-length', 'connection'):
+                    head += f"{name}: {headers[name]}\r\n"
+        head += "Connection: keep-alive\r\n" if keep_alive else "Connection: close\r\n"
+        self.head = head.encode('utf-8')
+
+
+async def _exchange(reader, writer, template, data, timeout, content_length=None):
+    if content_length is None:
+        content_length = len(data) if data else 0
+    writer.write(template.head)
+    writer.write(f"Content-Length: {content_length}\r\n\r\n".encode())
+    if isinstance(data, (bytes, bytearray)):
+        writer.write(data)
+    elif data is not None:
+        # Streamed body: write each part as it is produced
+        for part in data:
+            writer.write(part)
+            await asyncio.wait_for(writer.drain(), timeout)
+    await asyncio.wait_for(writer.drain(), timeout)
+    return await _read_response(reader, timeout)
+
+
+def _reusable(response):
+    """True if the connection can carry another request after this response."""
+    headers = response.headers
+    if headers.get('connection', '').lower() == 'close':
+        return False
+    return 'content-length' in headers or \
+        headers.get('transfer-encoding', '').lower() == 'chunked'
+
+
+async def send(template, data=None, connect_timeout=CONNECT_TIMEOUT,
+               read_timeout=READ_TIMEOUT, pool=None, content_length=None):
+    """
+    Send a request built from a RequestTemplate without blocking the event loop.
+    data may be str, bytes, or an iterable of bytes parts streamed to the
+    socket, in which case content_length must be given.
+    With a ConnectionPool (and a keep-alive template) the connection is kept
+    alive for the next request.
+    Raises asyncio.TimeoutError if connecting or reading takes too long.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    key = template.key
+
+    if pool is None:
+        reader, writer = await _open(key[0], key[1], key[2], connect_timeout)
+        try:
+            return await _exchange(reader, writer, template, data, read_timeout, content_length)
+        finally:
+            _close(writer)
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    while True:
+        reader, writer, reused = await pool.acquire(key, connect_timeout)
+        try:
+            response = await _exchange(reader, writer, template, data, read_timeout,
+                                       content_length)
+        except asyncio.TimeoutError:
+            _close(writer)
+            raise
+        except (OSError, EOFError) as e:
+            _close(writer)
+            if reused:
+                # The server dropped the idle connection; retry on a fresh one
+                print(f"Stale connection to {template.host}, reconnecting: {e}")
+                continue
+            raise
+        except BaseException:
+            _close(writer)
+            raise
+        if _reusable(response):
+            pool.release(key, reader, writer)
+        else:
+            _close(writer)
+        return response
+
+
+async def request(method, url, data=None, headers=None, pool=None, **kw):
+    """Perform a one-off HTTP/1.1 request; see send() for the arguments."""
+    template = RequestTemplate(method, url, headers, keep_alive=pool is not None)
+    return await send(template, data, pool=pool, **kw)
+
+
+async def get(url, **kw):
+    return await request('GET', url, **kw)
+
+
+async def put(url, data=None, **kw):
+    return await request('PUT', url, data, **kw)
+
+
+async def post(url, data=None, **kw):
+    return await request('POST', url, data, **kw)
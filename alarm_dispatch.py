@@ -0,0 +1,76 @@
+# alarm_dispatch.py
+
+import time
+import uasyncio as asyncio
+
+# Room states
+IDLE = "idle"
+RINGING = "ringing"
+ACKNOWLEDGED = "acknowledged"
+
+# Repeat presses of a ringing room within this window are coalesced
+DEFAULT_COALESCE_MS = 30000
+
+
+class AlarmDispatcher:
+    """
+    Runs room alarms concurrently, one task per room, with a small state
+    machine per room:
+
+        idle/acknowledged --press--> ringing (alarm task started)
+        ringing --press within window or while sending--> ringing (coalesced)
+        ringing --press after window--> ringing (alarm task restarted)
+        ringing --acknowledge--> acknowledged --task done--> idle
+    """
+
+    def __init__(self, handler, window_ms=DEFAULT_COALESCE_MS):
+        self._handler = handler  # async handler(room, *args)
+        self.window_ms = window_ms
+        self.coalesced = 0
+        # room -> [state, ticks of last dispatch, running task or None]
+        self._rooms = {}
+
+    def state(self, room):
+        """Return the current state of a room."""
+        entry = self._rooms.get(room)
+        return entry[0] if entry else IDLE
+
+    def press(self, room, *args):
+        """
+        Handle a press for room; args are passed on to the handler.
+        Returns True if an alarm task was started.
+        """
+        now = time.ticks_ms()
+        entry = self._rooms.get(room)
+        if entry is None:
+            entry = [IDLE, now, None]
+            self._rooms[room] = entry
+        elif entry[0] == RINGING and (
+                entry[2] is not None or time.ticks_diff(now, entry[1]) < self.window_ms):
+            self.coalesced += 1
+            print(f"Coalesced repeat press for {room}")
+            return False
+
+        entry[0] = RINGING
+        entry[1] = now
+        entry[2] = asyncio.create_task(self._run(room, entry, args))
+        return True
+
+    async def _run(self, room, entry, args):
+        try:
+            await self._handler(room, *args)
+        except Exception as e:
+            print(f"Error dispatching alarm for {room}: {e}")
+        finally:
+            # A press after acknowledge_all() may have started a newer task
+            # for this room; leave its handle and state alone
+            if entry[2] is asyncio.current_task():
+                entry[2] = None
+                if entry[0] == ACKNOWLEDGED:
+                    entry[0] = IDLE
+
+    def acknowledge_all(self):
+        """Acknowledge every ringing room (the reset button was pressed)."""
+        for entry in self._rooms.values():
+            if entry[0] == RINGING:
+                entry[0] = ACKNOWLEDGED if entry[2] is not None else IDLE
@@ -0,0 +1,496 @@
+# alarm_log.py
+
+import ujson
+import uos
+import time
+import uasyncio as asyncio
+
+# Journal files
+CHILD_LOG_FILE = "alarms.log"
+MOTHER_LOG_FILE = "mother_alarms.log"
+
+# Bytes read from the end of a journal to recover the last sequence number
+TAIL_BYTES = 512
+
+# Default retention policy, overridable through config['alarm_retention']
+DEFAULT_RETENTION = {
+    "max_entries": 500,        # Ring capacity per journal
+    "max_age_days": 90,        # 0 disables age-based eviction
+    "drop_synced_first": True, # Never age out records that are not settled
+    "low_water": 0.8           # Fraction of max_entries kept after an overflow
+}
+
+
+class AlarmJournal:
+    """
+    Append-only alarm journal holding one JSON record per line.
+
+    Every record gets a monotonically increasing "seq" number on append.
+    A marker file next to the journal stores a byte offset and the seq of
+    the last settled record: records that end at or before the offset are
+    settled (synced to the cloud for child alarms, silenced for mother
+    alarms). Appends never rewrite existing records.
+
+    The journal behaves as a fixed-capacity ring buffer: compaction evicts the
+    oldest records once the capacity is exceeded and counts every eviction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.marker_path = path + ".mark"
+        self.stats_path = path + ".stats"
+        self.generation = 0
+        self._size = None
+        self._count = 0
+        self._seq = 0
+        self._marker = None
+        self._marker_seq = 0
+        self._stats = None
+        # Readers holding byte offsets into the journal (see hold())
+        self._holds = 0
+
+    def _open(self):
+        """Recover the journal on first use and cache its size."""
+        if self._size is not None:
+            return
+        try:
+            size = uos.stat(self.path)[6]
+        except OSError:
+            size = 0
+        if size:
+            with open(self.path, 'rb') as f:
+                f.seek(size - 1)
+                last = f.read(1)
+            if last != b'\n':
+                # Terminate a torn last record left behind by a crash
+                # mid-append; readers skip it as an unparsable line.
+                print(f"Recovering torn record in {self.path}")
+                with open(self.path, 'ab') as f:
+                    f.write(b'\n')
+                size += 1
+        self._size = size
+        self._count = self._count_records()
+        self._seq = self._recover_seq()
+
+    def _recover_seq(self):
+        """Return the seq of the last record, read from the journal tail."""
+        if not self._size:
+            return 0
+        with open(self.path, 'rb') as f:
+            f.seek(max(self._size - TAIL_BYTES, 0))
+            tail = f.read()
+        lines = tail.split(b'\n')
+        for line in reversed(lines[1:] if self._size > TAIL_BYTES else lines):
+            try:
+                record = ujson.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and 'seq' in record:
+                return record['seq']
+        # Oversized or legacy records at the tail: fall back to a full scan
+        seq = 0
+        for _, record in self.records():
+            seq = max(seq, record.get('seq', 0))
+        return seq
+
+    def _count_records(self):
+        """Count the lines in the journal without loading it."""
+        count = 0
+        try:
+            with open(self.path, 'rb') as f:
+                buf = bytearray(256)
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    count += bytes(buf[:n]).count(b'\n')
+        except OSError:
+            pass
+        return count
+
+    def count(self):
+        """Return the number of records in the journal."""
+        self._open()
+        return self._count
+
+    def size(self):
+        """Return the journal size in bytes."""
+        self._open()
+        return self._size
+
+    def last_seq(self):
+        """Return the seq of the newest record."""
+        self._open()
+        return self._seq
+
+    def append(self, record):
+        """Append a record, assigning its seq, and return the offset just past it."""
+        self._open()
+        self._seq += 1
+        record['seq'] = self._seq
+        line = (ujson.dumps(record) + '\n').encode('utf-8')
+        with open(self.path, 'ab') as f:
+            f.write(line)
+        self._size += len(line)
+        self._count += 1
+        self.generation += 1
+        return self._size
+
+    def extend(self, records):
+        """Append several records with a single write; returns the new end offset."""
+        self._open()
+        lines = []
+        for record in records:
+            self._seq += 1
+            record['seq'] = self._seq
+            lines.append(ujson.dumps(record) + '\n')
+        data = ''.join(lines).encode('utf-8')
+        with open(self.path, 'ab') as f:
+            f.write(data)
+        self._size += len(data)
+        self._count += len(lines)
+        self.generation += 1
+        return self._size
+
+    def records(self, start=0):
+        """Yield (end_offset, record) for every readable record from start."""
+        self._open()
+        if start >= self._size:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            offset = start
+            while True:
+                line = f.readline()
+                if not line:
+                    break
+                offset += len(line)
+                try:
+                    record = ujson.loads(line)
+                except ValueError:
+                    continue  # Torn or corrupted record
+                if isinstance(record, dict):
+                    yield offset, record
+
+    def batch(self, start, limit):
+        """Return up to limit (end_offset, record) pairs from start."""
+        batch = []
+        records = self.records(start)
+        for item in records:
+            batch.append(item)
+            if len(batch) >= limit:
+                break
+        records.close()  # Release the file handle now
+        return batch
+
+    def pending(self):
+        """Yield (end_offset, record) for records past the marker."""
+        return self.records(self.marker())
+
+    def has_pending(self):
+        """Return True if there are records past the marker."""
+        return self.size() > self.marker()
+
+    def _load_marker(self):
+        if self._marker is not None:
+            return
+        self._marker = self._marker_seq = 0
+        try:
+            with open(self.marker_path, 'r') as f:
+                fields = f.read().split()
+            # "<offset> <seq>"; older markers hold the offset only
+            if fields:
+                self._marker = int(fields[0])
+            if len(fields) > 1:
+                self._marker_seq = int(fields[1])
+        except (OSError, ValueError):
+            pass
+
+    def marker(self):
+        """Return the settled offset stored in the marker file."""
+        self._load_marker()
+        return self._marker
+
+    def marker_seq(self):
+        """Return the seq of the last settled record (0 if unknown)."""
+        self._load_marker()
+        return self._marker_seq
+
+    def set_marker(self, offset, seq=None):
+        """Persist a new settled offset and, if given, the last settled seq."""
+        if seq is None:
+            seq = self.marker_seq()
+        tmp_path = self.marker_path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(f"{offset} {seq}")
+            try:
+                uos.rename(tmp_path, self.marker_path)
+            except OSError:
+                # Some filesystems refuse to rename over an existing file
+                uos.remove(self.marker_path)
+                uos.rename(tmp_path, self.marker_path)
+        except OSError as e:
+            print(f"Error writing marker {self.marker_path}: {e}")
+            return False
+        self._marker = offset
+        self._marker_seq = seq
+        self.generation += 1
+        return True
+
+    def settle_all(self):
+        """Move the marker to the end of the journal."""
+        return self.set_marker(self.size(), self.last_seq())
+
+    def hold(self):
+        """
+        Defer compaction until release(). Taken by readers that keep byte
+        offsets across an await, such as the cloud sync: a rewrite would
+        move every record and make those offsets point at the wrong ones.
+        """
+        self._holds += 1
+
+    def release(self):
+        self._holds -= 1
+
+    def held(self):
+        return self._holds > 0
+
+    def stats(self):
+        """Return the persistent eviction counters."""
+        if self._stats is None:
+            try:
+                with open(self.stats_path, 'r') as f:
+                    self._stats = ujson.load(f)
+            except (OSError, ValueError):
+                self._stats = {"evicted_synced": 0, "evicted_unsynced": 0}
+        return self._stats
+
+    def add_stat(self, name, count=1):
+        """Add count to a persistent counter kept next to the eviction counters."""
+        stats = self.stats()
+        stats[name] = stats.get(name, 0) + count
+        self._save_stats()
+
+    def _save_stats(self):
+        try:
+            with open(self.stats_path, 'w') as f:
+                ujson.dump(self._stats, f)
+        except OSError as e:
+            print(f"Error writing stats {self.stats_path}: {e}")
+
+    def compact(self, max_entries, max_age=0, drop_synced_first=True,
+                low_water=DEFAULT_RETENTION["low_water"]):
+        """
+        Rewrite the journal keeping at most max_entries records.
+
+        Records older than max_age seconds are evicted too; with
+        drop_synced_first only settled records are aged out, so unsettled
+        ones are lost only when the ring is full. An overflowing journal
+        drops settled records down to low_water * max_entries, so it is
+        rewritten once per batch of alarms rather than on every new one;
+        unsettled records are only dropped to get back to max_entries. The journal
+        is left untouched when nothing needs evicting. Returns the eviction
+        count, or None if compaction is deferred by hold().
+        """
+        if self._holds:
+            print(f"Compaction of {self.path} deferred while it is being read")
+            return None
+        return self._compact(max_entries, max_age, drop_synced_first, low_water)
+
+    def _compact(self, max_entries, max_age, drop_synced_first, low_water):
+        self._open()
+        marker = self.marker()
+        cutoff = _age_cutoff(max_age)
+
+        # First pass: count the records that survive the age limit
+        kept = kept_settled = expired = 0
+        for end, record in self.records():
+            settled = end <= marker
+            if self._expired(record, settled, cutoff, drop_synced_first):
+                expired += 1
+            else:
+                kept += 1
+                if settled:
+                    kept_settled += 1
+        if not expired and kept <= max_entries and kept == self._count:
+            return 0  # Nothing to evict or clean up: spare the flash a rewrite
+        # On overflow, settled records go first, down to the low-water mark;
+        # unsettled ones only as far as needed to fit max_entries
+        overflow_settled = overflow_unsettled = 0
+        if kept > max_entries:
+            overflow_settled = min(kept_settled, kept - int(max_entries * low_water))
+            overflow_unsettled = max(kept - overflow_settled - max_entries, 0)
+
+        # Second pass: copy the surviving records, oldest overflow dropped
+        tmp_path = self.path + ".tmp"
+        new_size = new_marker = count = 0
+        evicted_synced = evicted_unsynced = 0
+        with open(tmp_path, 'wb') as out:
+            for end, record in self.records():
+                settled = end <= marker
+                evict = self._expired(record, settled, cutoff, drop_synced_first)
+                if not evict and settled and overflow_settled > 0:
+                    overflow_settled -= 1
+                    evict = True
+                elif not evict and not settled and overflow_unsettled > 0:
+                    overflow_unsettled -= 1
+                    evict = True
+                if evict:
+                    if settled:
+                        evicted_synced += 1
+                    else:
+                        evicted_unsynced += 1
+                    continue
+                line = (ujson.dumps(record) + '\n').encode('utf-8')
+                out.write(line)
+                new_size += len(line)
+                count += 1
+                if settled:
+                    new_marker = new_size
+
+        evicted = evicted_synced + evicted_unsynced
+        if not evicted and count == self._count:
+            uos.remove(tmp_path)
+            return 0
+
+        # The marker is written first: a crash before the journal rename
+        # leaves an older offset, which only re-sends already settled records.
+        self.set_marker(new_marker)
+        try:
+            uos.rename(tmp_path, self.path)
+        except OSError:
+            uos.remove(self.path)
+            uos.rename(tmp_path, self.path)
+        self._size = new_size
+        self._count = count
+        self.generation += 1
+
+        stats = self.stats()
+        stats["evicted_synced"] = stats.get("evicted_synced", 0) + evicted_synced
+        stats["evicted_unsynced"] = stats.get("evicted_unsynced", 0) + evicted_unsynced
+        self._save_stats()
+        if evicted_unsynced:
+            print(f"Warning: {evicted_unsynced} unsynced records evicted from {self.path}")
+        print(f"Compacted {self.path}: kept {count}, evicted {evicted}")
+        return evicted
+
+    @staticmethod
+    def _expired(record, settled, cutoff, drop_synced_first):
+        if cutoff is None or (drop_synced_first and not settled):
+            return False
+        stamp = record_time(record)
+        return stamp is not None and stamp < cutoff
+
+
+def record_time(record):
+    """Return the record timestamp in seconds, or None if it has none."""
+    stamp = record.get('alarmTime') or record.get('date')
+    try:
+        date, clock = stamp.split(' ')
+        year, month, day = [int(x) for x in date.split('-')]
+        hour, minute, second = [int(x) for x in clock.split(':')]
+        return time.mktime((year, month, day, hour, minute, second, 0, 0))
+    except Exception:
+        return None
+
+
+def _age_cutoff(max_age):
+    """Return the oldest timestamp to keep, or None if ageing is disabled."""
+    if not max_age:
+        return None
+    # Skip ageing until the clock has been set by NTP or the RTC
+    if time.localtime()[0] < 2024:
+        return None
+    return time.time() - max_age
+
+
+child_journal = AlarmJournal(CHILD_LOG_FILE)
+mother_journal = AlarmJournal(MOTHER_LOG_FILE)
+
+
+def retention_policy(config):
+    """Merge config['alarm_retention'] over the default retention policy."""
+    policy = dict(DEFAULT_RETENTION)
+    overrides = config.get('alarm_retention') if config else None
+    if isinstance(overrides, dict):
+        policy.update(overrides)
+    return policy
+
+
+def compact_journals(policy):
+    """Apply the retention policy to both journals; False if one was deferred."""
+    done = True
+    for journal in (child_journal, mother_journal):
+        try:
+            if journal.compact(int(policy["max_entries"]),
+                            int(policy["max_age_days"]) * 86400,
+                            policy["drop_synced_first"],
+                            float(policy["low_water"])) is None:
+                done = False
+        except Exception as e:
+            print(f"Error compacting {journal.path}: {e}")
+    return done
+
+
+async def compaction_loop(interval=60, age_interval=3600):
+    """
+    Background compaction: runs as soon as a journal exceeds its capacity,
+    and at least every age_interval seconds to apply the age limit.
+    """
+    from utils import load_config  # utils imports this module
+    since_age_check = age_interval
+    while True:
+        policy = retention_policy(load_config())
+        capacity = int(policy["max_entries"])
+        if since_age_check >= age_interval:
+            if compact_journals(policy):
+                since_age_check = 0  # Otherwise retried on the next round
+        elif child_journal.count() > capacity or mother_journal.count() > capacity:
+            compact_journals(policy)
+        await asyncio.sleep(interval)
+        since_age_check += interval
+
+
+def _migrate_list(journal, entries, settled, strip_key=None):
+    """Append legacy entries, settled ones first, and place the marker."""
+    was_pending = journal.has_pending()
+    pending = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        is_settled = settled(entry)
+        if strip_key:
+            entry.pop(strip_key, None)
+        if is_settled:
+            journal.append(entry)
+        else:
+            pending.append(entry)
+    # Never settle records that were already pending in the journal
+    if not was_pending:
+        journal.settle_all()
+    for entry in pending:
+        journal.append(entry)
+
+
+def migrate_from_config(config):
+    """
+    Move legacy 'last_alarm' and 'mother_alarms' lists out of the config
+    into the journals. Returns True if the config was changed and needs saving.
+    """
+    changed = False
+    last_alarm = config.pop('last_alarm', None)
+    if last_alarm is not None:
+        changed = True
+        if isinstance(last_alarm, list):
+            _migrate_list(child_journal, last_alarm,
+                          lambda entry: entry.get('synced', False), 'synced')
+    mother_alarms = config.pop('mother_alarms', None)
+    if mother_alarms is not None:
+        changed = True
+        if isinstance(mother_alarms, list):
+            _migrate_list(mother_journal, mother_alarms,
+                          lambda entry: not entry.get('ring', False))
+    if changed:
+        print("Alarm history migrated from configuration to journals.")
+    return changed
@@ -1,30 +1,116 @@
-import urequests
+import ahttp
+import udp_alarm
+import outbox
 import uasyncio as asyncio
 import json
+import time
+import urandom
 from wifi_connect import connect_to_wifi
 from utils import *
+from alarm_log import child_journal, record_time
+from identity import get_identity
 from time_sync import get_current_datetime_string
 
 # Constants
 BASE_URL = "https://erp.arxcess.com/arxcess-erp-api"
-PING_URL = f"{BASE_URL}/open-accommodation-machines/ping"
-EMERGENCIES_URL = f"{BASE_URL}/open-accommodation-machines/sync-emergencies"
+PING_PATH = "/open-accommodation-machines/ping"
+EMERGENCIES_PATH = "/open-accommodation-machines/sync-emergencies"
+# Mother units are on the local network; give up on them quickly
+MOTHER_CONNECT_TIMEOUT = 2
+MOTHER_READ_TIMEOUT = 3
+# Overall time allowed for delivering one alarm to all mothers
+MOTHER_DEADLINE = 8
+
+# Alarms uploaded per cloud sync request
+SYNC_BATCH_SIZE = 20
+# An alarm the cloud answers for without acknowledging is retried on later
+# syncs and only skipped after this many refusals, counted per journal seq
+MAX_REFUSALS = 3
+REFUSALS_FILE = "sync_refusals.json"
+# Compact alarm upload encoding, negotiated with the cloud through this header
+ENCODING_HEADER = "X-Alarm-Encoding"
+COLUMNAR = "columnar"
+# Cloud scheduler: heartbeat interval and ceiling for the unreachable backoff, in seconds
+CLOUD_INTERVAL = 60
+CLOUD_BACKOFF_MAX = 900
+
+# Warm keep-alive connections to mother units, keyed by IP
+mother_pool = ahttp.ConnectionPool()
+
+# Per-mother delivery metrics: ip -> sent/failed counts and latencies in ms
+mother_delivery_stats = {}
+
+# Columnar uploads: None until the cloud advertises or rejects them
+_columnar_ok = None
+
+# Refusal counts by seq (as a string), loaded from REFUSALS_FILE on first use
+_refusals = None
+
 HEADERS = {
     'accept': 'application/json',
     'Content-Type': 'application/json',
     'User-Agent': 'Mozilla/5.0 (platform; rv:gecko-version) Gecko/gecko-trail Firefox/firefox-version'
 }
 
-async def send_alarm_to_mother(room):
+def cloud_url(config, path):
+    """Cloud endpoint URL; config['cloud_base_url'] points the device at another server."""
+    return (config.get('cloud_base_url') or BASE_URL) + path
+
+
+# Prebuilt request templates per destination, rebuilt when the config changes
+_templates = None
+_templates_gen = None
+
+
+def request_templates():
+    """
+    Return the request templates for the cloud ("ping", "sync",
+    "sync_columnar") and for each mother IP ("mothers").
+    """
+    global _templates, _templates_gen
+    generation = config_generation()
+    if _templates is None or generation != _templates_gen:
+        config = load_config()
+        query = f"?code={config.get('machine_code')}&token={config.get('machine_token')}"
+        sync_url = cloud_url(config, EMERGENCIES_PATH) + query
+        columnar_headers = dict(HEADERS)
+        columnar_headers[ENCODING_HEADER] = COLUMNAR
+        _templates = {
+            "ping": ahttp.RequestTemplate('PUT', cloud_url(config, PING_PATH) + query, HEADERS),
+            "sync": ahttp.RequestTemplate('POST', sync_url, HEADERS),
+            "sync_columnar": ahttp.RequestTemplate('POST', sync_url, columnar_headers),
+            "mothers": {}
+        }
+        for ip in (config.get('mothers') or '').split(','):
+            if ip.strip():
+                mother_template(ip.strip(), _templates)
+        _templates_gen = generation
+    return _templates
+
+
+def mother_template(ip, templates=None):
+    """Return the keep-alive alarm request template for a mother IP."""
+    mothers = (templates or request_templates())["mothers"]
+    template = mothers.get(ip)
+    if template is None:
+        # Also covers queued alarms for a mother no longer in the config
+        template = ahttp.RequestTemplate('PUT', f"http://{ip}/api/mother/alarm", HEADERS,
+                                         keep_alive=True)
+        mothers[ip] = template
+    return template
+
+
+async def send_alarm_to_mother(room, template=None):
     """
     Asynchronously sends an alarm to mother devices for a specific room.
+    template is the precomputed payload base for the room's button, if any.
     """
     config = load_config()
     if not config:
         print("Failed to load configuration.")
         return
 
-    block_name = config.get('block_name')
+    block_name = template.get('block_name') if template else get_identity()['block_name']
     mother_ips_str = config.get('mothers')  # Get the mother IPs as a string
 
     if not block_name or not room:
@@ -45,83 +131,138 @@ async def send_alarm_to_mother(room):
     mother_ips = [ip.strip() for ip in mother_ips_str.split(',')]
 
     # Send alarm to mother servers
-    await send_alarm_to_mothers(block_name, room, mother_ips)
+    await send_alarm_to_mothers(block_name, room, mother_ips, template=template)
 
-async def send_alarm_to_mothers(block_name, room, mother_ips, retries=2, delay=1):
+def record_delivery(ip, isSent, latency_ms):
     """
-    Asynchronously sends alarms to multiple mother devices and updates the configuration.
+    Updates the per-mother delivery metrics.
     """
-    datetime_str = get_current_datetime_string()
-
-    for ip in mother_ips:
-        url = f"http://{ip}/api/mother/alarm"
-        reference = gen_reference()
-        payload = {
-            "block_name": block_name,
-            "room": room,
-            "date": datetime_str,
-            "reference": reference,
-            "mode": device_mode()
-        }
-
-        isSent = False  # Default to False
+    stats = mother_delivery_stats.get(ip)
+    if stats is None:
+        stats = {"sent": 0, "failed": 0, "last_ms": 0, "max_ms": 0, "total_ms": 0}
+        mother_delivery_stats[ip] = stats
+    if isSent:
+        outbox.mark_reachable(ip)
+        stats["sent"] += 1
+        stats["last_ms"] = latency_ms
+        stats["total_ms"] += latency_ms
+        if latency_ms > stats["max_ms"]:
+            stats["max_ms"] = latency_ms
+    else:
+        stats["failed"] += 1
+
+async def deliver_to_mother(ip, payload_str, outcomes, retries=2, delay=1):
+    """
+    Sends one alarm to one mother device, retrying on failure.
+    The outcome is stored in outcomes[ip] as soon as it is known.
+    """
+    template = mother_template(ip)
+    start = time.ticks_ms()
 
-        for attempt in range(1, retries + 1):
-            try:
-                print(f"Attempt {attempt}: Sending alarm to mother server at {ip}...")
-                response = urequests.put(url, data=json.dumps(payload), headers=HEADERS)
-                if response.status_code == 200:
-                    isSent = True
-                    print(f"Successfully sent alarm to {ip}: {response.status_code} - {response.text}")
-                    response.close()
-                    break  # Exit the retry loop on success
-                else:
-                    print(f"Failed to send alarm to {ip}: {response.status_code} - {response.text}")
+    for attempt in range(1, retries + 1):
+        try:
+            print(f"Attempt {attempt}: Sending alarm to mother server at {ip}...")
+            response = await ahttp.send(template, payload_str,
+                                       connect_timeout=MOTHER_CONNECT_TIMEOUT,
+                                       read_timeout=MOTHER_READ_TIMEOUT,
+                                       pool=mother_pool)
+            if response.status_code == 200:
+                latency_ms = time.ticks_diff(time.ticks_ms(), start)
+                outcomes[ip] = latency_ms
+                record_delivery(ip, True, latency_ms)
+                print(f"Successfully sent alarm to {ip} in {latency_ms} ms: {response.status_code} - {response.text}")
                 response.close()
-            except Exception as e:
-                print(f"Error sending to {ip}: {e}")
+                return True
+            else:
+                print(f"Failed to send alarm to {ip}: {response.status_code} - {response.text}")
+            response.close()
+        except Exception as e:
+            print(f"Error sending to {ip}: {e}")
 
-            # Wait before the next retry
+        # Wait before the next retry
+        if attempt < retries:
             await asyncio.sleep(delay)
 
-        # Update 'last_alarm' in config regardless of success or failure
-        await update_last_alarm(room, datetime_str, reference, isSent)
-        
-        # Yield control to the event loop
-        await asyncio.sleep(0)
+    record_delivery(ip, False, 0)
+    return False
 
-async def update_last_alarm(room, datetime_str, reference, isSent):
+async def redeliver_to_mother(ip, payload_str):
     """
-    Asynchronously updates the 'last_alarm' key in the configuration file.
+    Single delivery attempt used by the outbox worker.
     """
-    config = load_config()
-    if config is None:
-        print("Failed to load configuration for updating 'last_alarm'.")
-        return
+    return await deliver_to_mother(ip, payload_str, {}, retries=1)
 
-    # Ensure 'last_alarm' is a list
-    if 'last_alarm' not in config or not isinstance(config['last_alarm'], list):
-        config['last_alarm'] = []
-        
+async def send_alarm_to_mothers(block_name, room, mother_ips, retries=2, delay=1, template=None,
+                                deadline=MOTHER_DEADLINE):
+    """
+    Asynchronously sends the alarm to all mother devices in parallel and
+    records it, with the per-mother outcome, in the alarm journal.
+    """
+    datetime_str = get_current_datetime_string()
+    reference = gen_reference()
+    payload = dict(template) if template else {"block_name": block_name, "room": room}
+    payload["date"] = datetime_str
+    payload["reference"] = reference
+    payload["mode"] = device_mode()
+    payload_str = json.dumps(payload)
+    payload_bytes = payload_str.encode('utf-8')
+
+    # ip -> delivery latency in ms, or None if not delivered
+    outcomes = {ip: None for ip in mother_ips}
+    http_ips = mother_ips
+
+    # Optional UDP fast path: one multicast packet reaches every mother
+    if load_config().get('udp_alarms'):
+        acked = await udp_alarm.send_alarm(payload, mother_ips)
+        for ip in acked:
+            outcomes[ip] = acked[ip]
+            record_delivery(ip, True, acked[ip])
+            print(f"Alarm acknowledged over UDP by {ip} in {acked[ip]} ms")
+        http_ips = [ip for ip in mother_ips if ip not in acked]
+
+    # HTTP for every mother that did not ack over UDP
+    tasks = [deliver_to_mother(ip, payload_bytes, outcomes, retries, delay) for ip in http_ips]
+    if tasks:
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks), deadline)
+        except asyncio.TimeoutError:
+            print(f"Delivery deadline of {deadline} s reached; undelivered: "
+                  f"{[ip for ip in outcomes if outcomes[ip] is None]}")
+
+    isSent = any(latency is not None for latency in outcomes.values())
+
+    # Hand undelivered mothers to the background retry worker
+    for ip in outcomes:
+        if outcomes[ip] is None:
+            outbox.enqueue(ip, payload_str)
+
+    # Record the alarm regardless of success or failure
+    await update_last_alarm(room, datetime_str, reference, isSent, outcomes)
+
+async def update_last_alarm(room, datetime_str, reference, isSent, outcomes=None):
+    """
+    Asynchronously appends the alarm to the alarm journal.
+    outcomes maps each mother IP to its delivery latency in ms (None if undelivered).
+    """
     # Create the alarm entry
     alarm_entry = {
         "roomName": room,
         "alarmTime": datetime_str,
         "reference": reference,
         "isSent": isSent,
-        "mode": device_mode(),
-        "synced": False
+        "mode": device_mode()
     }
+    if outcomes:
+        alarm_entry["mothers"] = outcomes
 
     # Append the new alarm entry
-    config['last_alarm'].append(alarm_entry)
-    print(f"Updated 'last_alarm' with: {alarm_entry}")
-
-    # Save the updated configuration
     try:
-        save_config(config)
+        child_journal.append(alarm_entry)
+        print(f"Recorded alarm: {alarm_entry}")
     except Exception as e:
-        print(f"Error updating 'last_alarm' in configuration: {e}")
+        print(f"Error recording alarm in journal: {e}")
+        return
+    request_cloud_sync()
 
 async def ping_server_call(retries=1, backoff_factor=2):
     """
@@ -132,33 +273,25 @@ async def ping_server_call(retries=1, backoff_factor=2):
         print("Failed to load configuration.")
         return False
 
-    code = config.get('machine_code')
-    token = config.get('machine_token')
-    ipAddress = config.get('ip_address')
-    mac_address = get_mac_address()
-    rooms = config.get('number_of_rooms')
-    firmware_version = get_firmware_version()
+    device = get_identity()
+    code = device['machine_code']
+    token = device['machine_token']
 
-    if not code or not token or not ipAddress:
+    if not code or not token or not device['ip_address']:
         print("Machine code or token missing in configuration.")
         return False
 
-    payload = {
-        "ipAddress": ipAddress,
-        "mac_address": mac_address,
-        "rooms": rooms,
-        "firmware_version": firmware_version
-    }
-    full_url = f"{PING_URL}?code={code}&token={token}"
+    payload = device['ping_payload']
+    template = request_templates()["ping"]
 
-    print(f"Pinging server at: {full_url}")
-    print(f"Payload: {json.dumps(payload)}")
+    print(f"Pinging server at: {template.url}")
+    print(f"Payload: {payload.decode()}")
 
     delay = 1  # Initial delay in seconds
 
     for attempt in range(1, retries + 1):
         try:
-            response = urequests.put(full_url, data=json.dumps(payload), headers=HEADERS)
+            response = await ahttp.send(template, payload)
             if response.status_code == 200:
                 print("Ping successful:", response.text)
                 response.close()
@@ -175,79 +308,140 @@ async def ping_server_call(retries=1, backoff_factor=2):
             delay *= backoff_factor  # Exponential backoff
 
     print("All ping attempts failed.")
-    send_alarms_to_cloud()
     return False
 
-async def send_alarms_to_cloud(retries=1, backoff_factor=2):
-    config = load_config()
-    if not config:
-        print("Failed to load configuration.")
-        return False
-
-    code = config.get('machine_code')
-    token = config.get('machine_token')
-
-    if not code or not token:
-        print("Machine code or token missing in configuration.")
-        return False
-
-    # Filter unsynced alarms
-    unsynced_alarms = [alarm for alarm in config.get('last_alarm', []) if not alarm.get('synced', False)]
-
-    if not unsynced_alarms:
-        print("No unsynced alarms to send.")
-        return True
-
+def _cloud_record(alarm):
+    """Serialize one journal record the way the cloud expects it."""
     # Convert booleans to strings to avoid serialization issues
-    modified_alarms = []
-    for alarm in unsynced_alarms:
-        modified_alarm = {}
-        for key, value in alarm.items():
-            if isinstance(value, bool):
-                modified_alarm[key] = str(value).lower()  # Convert True/False to "true"/"false"
-            else:
-                modified_alarm[key] = value
-        modified_alarms.append(modified_alarm)
+    modified_alarm = {}
+    for key, value in alarm.items():
+        if key in ('mothers', 'seq'):
+            continue  # Delivery details and the sync cursor stay on the device
+        if isinstance(value, bool):
+            modified_alarm[key] = str(value).lower()  # Convert True/False to "true"/"false"
+        else:
+            modified_alarm[key] = value
+    modified_alarm['synced'] = "false"
+    return ujson.dumps(modified_alarm).encode('utf-8')
+
+
+def _batch_length(batch):
+    """Content-Length of the JSON array for a batch, without building it."""
+    length = 2 + max(len(batch) - 1, 0)  # Brackets and commas
+    for _, alarm in batch:
+        length += len(_cloud_record(alarm))
+    return length
+
+
+def _batch_parts(batch):
+    """Yield the JSON array for a batch one record at a time."""
+    yield b'['
+    for i, (_, alarm) in enumerate(batch):
+        if i:
+            yield b','
+        yield _cloud_record(alarm)
+    yield b']'
+
+
+def _dictionary(values):
+    """Return (distinct values, index of each value) for dictionary encoding."""
+    distinct = []
+    index = {}
+    codes = []
+    for value in values:
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(distinct)
+            distinct.append(value)
+        codes.append(code)
+    return distinct, codes
+
+
+def _columnar_body(batch):
+    """
+    Encode a batch column by column. Room names and modes are sent once in
+    a dictionary and referenced by index, flags as 0/1, and alarm times as
+    second offsets from the first alarm.
+    """
+    alarms = [alarm for _, alarm in batch]
+    rooms, room_codes = _dictionary([alarm.get('roomName') for alarm in alarms])
+    modes, mode_codes = _dictionary([alarm.get('mode') for alarm in alarms])
+    body = {
+        "v": 1,
+        "rooms": rooms,
+        "room": room_codes,
+        "modes": modes,
+        "mode": mode_codes,
+        "reference": [alarm.get('reference') for alarm in alarms],
+        "isSent": [1 if alarm.get('isSent') in (True, "true") else 0 for alarm in alarms]
+    }
+    times = [record_time(alarm) for alarm in alarms]
+    if None in times:
+        body["alarmTime"] = [alarm.get('alarmTime') for alarm in alarms]
+    else:
+        body["t0"] = alarms[0].get('alarmTime')
+        body["dt"] = [stamp - times[0] for stamp in times]
+    return ujson.dumps(body).encode('utf-8')
 
-    # Serialize the payload
-    payload_str = ujson.dumps(modified_alarms)
-    # Convert to UTF-8 encoded bytes
-    payload_bytes = payload_str.encode('utf-8')
-    # Strip any trailing null bytes or whitespace
-    payload_bytes = payload_bytes.rstrip(b'\x00').rstrip()
 
-    # Explicitly set Content-Length in headers
-    headers = HEADERS.copy()  # Copy the default headers
-    headers['Content-Length'] = str(len(payload_bytes))
+def _use_columnar(config):
+    """Use columnar uploads if the cloud advertised them or the config asks for them."""
+    if _columnar_ok is None:
+        return bool(config.get('cloud_columnar'))
+    return _columnar_ok
 
-    full_url = f"{EMERGENCIES_URL}?code={code}&token={token}"
 
+async def _post_batch(batch, retries, backoff_factor, columnar=False):
+    """
+    POST one batch of journal records. Returns the list of references the
+    cloud acknowledged, False if it answered but did not accept the batch
+    (an error status, or a 200 without a readable list), or None if it
+    could not be reached.
+    """
+    global _columnar_ok
+    if columnar:
+        template = request_templates()["sync_columnar"]
+        body = _columnar_body(batch)
+        length = len(body)
+    else:
+        template = request_templates()["sync"]
+        length = _batch_length(batch)
     delay = 1  # Initial delay in seconds
+    answered = False
 
     for attempt in range(1, retries + 1):
         try:
-            response = urequests.post(full_url, data=payload_bytes, headers=headers)
-            print(f"Response Status: {response.status_code}")
-            print(f"Response Text: {response.text}")
+            data = body if columnar else _batch_parts(batch)
+            response = await ahttp.send(template, data, content_length=length)
+            print(f"Response Status: {response.status_code} ({length} bytes sent)")
+
+            advertised = response.headers.get(ENCODING_HEADER.lower()) == COLUMNAR
+            if columnar and (response.status_code in (400, 415) or
+                             (response.status_code == 200 and not advertised)):
+                # The cloud does not understand the columnar encoding; a server
+                # that does echoes the header back.
+                print("Cloud rejected columnar encoding, falling back to JSON.")
+                _columnar_ok = False
+                response.close()
+                return None
 
             if response.status_code == 200:
+                if advertised:
+                    _columnar_ok = True
                 print("Alarms sent successfully:", response.text)
                 try:
                     synced_references = response.json()
                 except Exception as e:
                     print(f"Failed to parse response as JSON: {e}")
-                    synced_references = []
-
-                for alarm in config['last_alarm']:
-                    if alarm['reference'] in synced_references:
-                        alarm['synced'] = True
-
-                save_config(config)
+                    synced_references = None
                 response.close()
-                return True
+                if not isinstance(synced_references, list):
+                    return False
+                return synced_references
             else:
                 print(f"Failed to send alarms with status {response.status_code}: {response.text}")
                 response.close()
+                answered = True
         except Exception as e:
             print(f"Error during alarm sync (Attempt {attempt}): {e}")
 
@@ -256,27 +450,207 @@ async def send_alarms_to_cloud(retries=1, backoff_factor=2):
             await asyncio.sleep(delay)
             delay *= backoff_factor
 
-    print("All attempts to send alarms failed.")
-    return False
+    return False if answered else None
+
+
+def _load_refusals():
+    global _refusals
+    if _refusals is None:
+        try:
+            with open(REFUSALS_FILE, 'r') as f:
+                _refusals = json.load(f)
+        except (OSError, ValueError):
+            _refusals = {}
+    return _refusals
 
-async def periodic_ping(interval=60):
+
+def _save_refusals():
+    try:
+        write_file_atomic(REFUSALS_FILE, json.dumps(_refusals))
+    except Exception as e:
+        print(f"Error writing {REFUSALS_FILE}: {e}")
+
+
+async def send_alarms_to_cloud(retries=1, backoff_factor=2, batch_size=SYNC_BATCH_SIZE):
     """
-    Periodically pings the server and sends unsynced alarms to the cloud.
+    Upload unsynced alarms in batches of batch_size records. Each batch is
+    streamed from the journal to the socket and marked synced as soon as the
+    cloud acknowledges it, so memory use does not grow with the backlog.
+    The marker only moves over acknowledged records. A record the cloud
+    answers for but does not acknowledge stops the sync and is retried on
+    the next one; after MAX_REFUSALS refusals it is skipped and counted in
+    the journal stats as "unacknowledged", so it cannot hold back the
+    records after it forever.
+
+    Returns True once everything is synced and acknowledged, False if the
+    cloud answered but did not accept every record (or the machine is not
+    configured), and None if the cloud could not be reached.
     """
+    # Check the journal before touching the configuration
+    if not child_journal.has_pending():
+        print("No unsynced alarms to send.")
+        return True
+
+    config = load_config()
+    if not config:
+        print("Failed to load configuration.")
+        return False
+
+    code = config.get('machine_code')
+    token = config.get('machine_token')
+
+    if not code or not token:
+        print("Machine code or token missing in configuration.")
+        return False
+
+    # The byte offsets of a batch must stay valid until its marker is
+    # written, so the journal is not compacted while the upload is in flight
+    child_journal.hold()
+    try:
+        sent = unacknowledged = 0
+        while True:
+            cursor = child_journal.marker_seq()
+            batch = child_journal.batch(child_journal.marker(), batch_size)
+            if not batch:
+                print(f"Synced {sent} alarms, {unacknowledged} skipped unacknowledged.")
+                return not unacknowledged
+
+            # Records at or below the cursor were acknowledged before the offset
+            # was last written (e.g. a crash during compaction): skip them.
+            skipped = 0
+            while skipped < len(batch) and batch[skipped][1].get('seq', cursor + 1) <= cursor:
+                skipped += 1
+            if skipped:
+                child_journal.set_marker(batch[skipped - 1][0])
+                continue
+
+            columnar = _use_columnar(config)
+            synced_references = await _post_batch(batch, retries, backoff_factor, columnar)
+            if synced_references is None:
+                if columnar and _columnar_ok is False:
+                    continue  # Resend the batch as plain JSON
+                print("All attempts to send alarms failed.")
+                return None
+            if synced_references is False:
+                print("Cloud did not accept the batch, stopping sync.")
+                return False
+
+            # Advance over the acknowledged prefix; the first refused record
+            # ends the sync unless it has been refused too often already
+            acked = set(synced_references)
+            refusals = _load_refusals()
+            synced = refused = None
+            changed = False
+            for end_offset, alarm in batch:
+                seq = alarm.get('seq', cursor)
+                reference = alarm.get('reference')
+                if reference in acked:
+                    sent += 1
+                else:
+                    count = refusals.get(str(seq), 0) + 1
+                    changed = True
+                    if count < MAX_REFUSALS:
+                        refusals[str(seq)] = count
+                        refused = (reference, count)
+                        break
+                    print(f"Cloud refused alarm {reference} {count} times, skipping it.")
+                    refusals.pop(str(seq), None)
+                    unacknowledged += 1
+                    child_journal.add_stat("unacknowledged")
+                synced = (end_offset, seq)
+            if synced:
+                child_journal.set_marker(synced[0], synced[1])
+                for key in list(refusals):
+                    if int(key) <= synced[1]:
+                        del refusals[key]
+                        changed = True
+            if changed:
+                _save_refusals()
+            if refused:
+                print(f"Cloud did not acknowledge alarm {refused[0]} "
+                      f"(refusal {refused[1]} of {MAX_REFUSALS}), retrying later.")
+                return False
+    finally:
+        child_journal.release()
+
+# Set when a new alarm is recorded so the scheduler syncs it right away
+_sync_wakeup = asyncio.Event()
+
+
+def request_cloud_sync():
+    """Ask the cloud scheduler to upload pending alarms now."""
+    _sync_wakeup.set()
+
+
+def _backoff_delay(failures, interval):
+    """Wait before the next attempt after failures consecutive failures, with jitter."""
+    delay = min(interval * (1 << min(failures - 1, 6)), CLOUD_BACKOFF_MAX)
+    return delay + urandom.getrandbits(8) % (delay // 4 + 1)
+
+
+async def cloud_scheduler(interval=CLOUD_INTERVAL):
+    """
+    Single loop for all cloud traffic.
+
+    A new alarm wakes the loop and is synced immediately. Alarm syncs double
+    as the heartbeat, so the ping is only sent when nothing was synced for
+    a whole interval. While the cloud is unreachable, attempts back off
+    exponentially; alarms recorded meanwhile wait in the journal for the
+    next attempt instead of waking the radio. If the cloud answers but does
+    not accept the pending alarms, they are retried with the heartbeat,
+    which keeps being sent every interval.
+    """
+    failures = 0
+    last_contact = None  # ticks_ms of the last successful cloud request
+    refused = False      # The cloud answered the last sync without accepting it
     while True:
-        print("Starting periodic ping...")
-        success = await ping_server_call()
-        if success:
-            print("Periodic ping successful.")
-            # Call send_alarms_to_cloud after a successful ping
-            print("Sending unsynced alarms to the cloud...")
-            alarms_sent = await send_alarms_to_cloud()
-            if alarms_sent:
-                print("Unsynced alarms sent successfully.")
-            else:
-                print("Failed to send unsynced alarms.")
+        if failures:
+            wait = _backoff_delay(failures, interval)
+        elif last_contact is None:
+            wait = 0
         else:
-            print("Periodic ping failed. Skipping alarm sync.")
+            elapsed = time.ticks_diff(time.ticks_ms(), last_contact) // 1000
+            wait = max(interval - elapsed, 0)
+
+        _sync_wakeup.clear()
+        # An alarm recorded while the previous request was in flight set the
+        # wakeup before it was cleared above: sync it now, not after the wait
+        if not failures and not refused and child_journal.has_pending():
+            wait = 0
+        if wait:
+            try:
+                if failures:
+                    await asyncio.sleep(wait)
+                else:
+                    await asyncio.wait_for(_sync_wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
 
-        print(f"Waiting for {interval} seconds before next ping.")
-        await asyncio.sleep(interval)
\ No newline at end of file
+        try:
+            due = last_contact is None or \
+                time.ticks_diff(time.ticks_ms(), last_contact) >= interval * 1000
+            if child_journal.has_pending() and (due or not refused):
+                result = await send_alarms_to_cloud()
+                refused = result is False
+                if result is not False:
+                    success = result is True  # None: the cloud is unreachable
+                elif due:
+                    # The cloud is up but refused the alarms: keep the heartbeat
+                    success = await ping_server_call()
+                else:
+                    failures = 0
+                    continue
+            elif due:
+                success = await ping_server_call()
+            else:
+                continue  # Woken early with nothing to send
+        except Exception as e:
+            print(f"Error in cloud scheduler: {e}")
+            success = False
+
+        if success:
+            failures = 0
+            last_contact = time.ticks_ms()
+        else:
+            failures += 1
+            print(f"Cloud unreachable, backing off ({failures} failures)")
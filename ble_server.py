@@ -5,6 +5,7 @@ import _thread
 import ujson
 from lcd_utils import display_message
 from wifi_connect import connect_to_wifi
+from utils import save_config
 
 class BLEServer:
     def __init__(self, name="ESP32-BLE"):
@@ -109,8 +110,7 @@ class BLEServer:
                 'block_name': self.received_block_name,
                 'number_of_rooms': self.received_number_of_rooms
             }
-            with open('wifi_config.json', 'w') as f:
-                ujson.dump(credentials, f)
+            save_config(credentials)
             
             print("All data saved successfully.")
             connect_to_wifi()
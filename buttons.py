@@ -0,0 +1,84 @@
+# buttons.py
+
+from machine import Pin
+from array import array
+import time
+import uasyncio as asyncio
+
+# Capacity of the IRQ event ring (one slot is always kept free)
+EVENT_RING_SIZE = 32
+
+# Edges closer than this on the same pin are treated as contact bounce
+DEBOUNCE_MS = 250
+
+
+class ButtonCapture:
+    """
+    Captures button presses with falling-edge IRQs.
+
+    Each IRQ stores a (pin, ticks_ms) event in a preallocated ring and wakes
+    the consumer through a ThreadSafeFlag. The IRQ side only writes the head
+    index and the consumer only writes the tail index, so no lock is needed.
+    Debouncing is per pin, so presses in different rooms never mask each other.
+    """
+
+    def __init__(self, pin_numbers, debounce_ms=DEBOUNCE_MS, size=EVENT_RING_SIZE):
+        self.pins = {}
+        self.dropped = 0
+        self.flag = asyncio.ThreadSafeFlag()
+        self._size = size
+        self._debounce_ms = debounce_ms
+        self._ring_pins = array('H', [0] * size)
+        self._ring_ticks = array('L', [0] * size)
+        self._head = 0
+        self._tail = 0
+        self._last_ticks = array('L', [0] * len(pin_numbers))
+
+        now = time.ticks_ms()
+        for slot, pin_num in enumerate(pin_numbers):
+            try:
+                pin = Pin(pin_num, Pin.IN, Pin.PULL_UP)
+            except ValueError as e:
+                print(f"Error initializing pin {pin_num}: {e}")
+                continue
+            self._last_ticks[slot] = time.ticks_add(now, -debounce_ms)
+            pin.irq(handler=self._make_handler(pin_num, slot), trigger=Pin.IRQ_FALLING)
+            self.pins[pin_num] = pin
+
+    def _make_handler(self, pin_num, slot):
+        """Build the IRQ handler for one pin. It must not allocate."""
+        def handler(pin):
+            now = time.ticks_ms()
+            if time.ticks_diff(now, self._last_ticks[slot]) < self._debounce_ms:
+                return
+            if pin.value():
+                return  # Release bounce, the button is no longer held
+            self._last_ticks[slot] = now
+            head = self._head
+            next_head = (head + 1) % self._size
+            if next_head == self._tail:
+                self.dropped += 1  # Ring full, consumer is stalled
+                return
+            self._ring_pins[head] = pin_num
+            self._ring_ticks[head] = now
+            self._head = next_head
+            self.flag.set()
+        return handler
+
+    def value(self, pin_num):
+        """Return the current level of a captured pin."""
+        return self.pins[pin_num].value()
+
+    async def run(self, callback):
+        """Drain the event ring forever, calling callback(pin, ticks_ms) per press."""
+        while True:
+            await self.flag.wait()
+            while self._tail != self._head:
+                tail = self._tail
+                pin_num = self._ring_pins[tail]
+                ticks = self._ring_ticks[tail]
+                self._tail = (tail + 1) % self._size
+                try:
+                    callback(pin_num, ticks)
+                except Exception as e:
+                    print(f"Error handling press on pin {pin_num}: {e}")
@@ -0,0 +1,70 @@
+# identity.py
+
+import ujson
+from utils import load_config, config_generation, get_mac_address, firmware_version
+
+# The MAC never changes, so it is read once per boot
+_mac_address = None
+
+# Cached identity and the state it was built from
+_identity = None
+_identity_gen = None
+_version_stale = True
+_firmware_version = None
+
+
+def _rooms(number_of_rooms):
+    """Split the configured room list ("R1,R2,...") into labels."""
+    if not number_of_rooms:
+        return []
+    return [room.strip() for room in number_of_rooms.split(',')]
+
+
+def _build(config):
+    global _mac_address, _firmware_version, _version_stale
+    if _mac_address is None:
+        _mac_address = get_mac_address()
+    if _version_stale:
+        _firmware_version = firmware_version()
+        _version_stale = False
+
+    identity = {
+        "mac_address": _mac_address,
+        "firmware_version": _firmware_version,
+        "machine_code": config.get('machine_code'),
+        "machine_token": config.get('machine_token'),
+        "ip_address": config.get('ip_address'),
+        "block_name": config.get('block_name'),
+        "number_of_rooms": config.get('number_of_rooms'),
+        "rooms": _rooms(config.get('number_of_rooms'))
+    }
+    # The ping body only changes with the identity, so encode it once here
+    identity["ping_payload"] = ujson.dumps({
+        "ipAddress": identity["ip_address"],
+        "mac_address": identity["mac_address"],
+        "rooms": identity["number_of_rooms"],
+        "firmware_version": identity["firmware_version"]
+    }).encode('utf-8')
+    return identity
+
+
+def get_identity():
+    """
+    Return the device identity dict. It is built once at boot and rebuilt
+    only when the configuration is saved or new firmware is installed.
+    """
+    global _identity, _identity_gen
+    generation = config_generation()
+    if _identity is None or generation != _identity_gen:
+        config = load_config()
+        _identity = _build(config)
+        # An unreadable config is retried on the next call
+        _identity_gen = generation if config else None
+    return _identity
+
+
+def firmware_changed():
+    """Called after an OTA update rewrites version.json."""
+    global _version_stale, _identity
+    _version_stale = True
+    _identity = None
@@ -7,9 +7,16 @@ from api_calls import *
 import uasyncio as asyncio
 from messages import *
 import server
+import udp_alarm
+import outbox
 from access_point import *
 from utils import *
+from alarm_log import migrate_from_config, compaction_loop
+import mother_store
+from identity import get_identity
 from time_sync import periodic_time_sync
+from buttons import ButtonCapture
+from alarm_dispatch import AlarmDispatcher, DEFAULT_COALESCE_MS
 import gc
 
 gc.collect()
@@ -18,13 +25,13 @@ print("Free memory:", gc.mem_free())
 ALARM_ON = False
 connect_to_wifi()
 asyncio.run(welcome())
-srv = server.start_server()
+srv = None
 
 # Initialize the Siren pin
 SIREN_PIN = Pin(3, Pin.OUT)
 
-# Initialize the Button pin
-BTN_PIN = Pin(43, Pin.IN, Pin.PULL_UP)
+# The Button pin (reset / connection info)
+BTN_PIN_NUM = 43
 
 # Define the list of button pins and their corresponding room names
 BUTTON_PINS = [
@@ -45,13 +52,8 @@ BUTTON_PINS = [
     (44, "Room 15"),
 ]
 
-# Initialize buttons
-buttons = {}
-for pin_num, _ in BUTTON_PINS:
-    try:
-        buttons[pin_num] = Pin(pin_num, Pin.IN, Pin.PULL_UP)
-    except ValueError as e:
-        print(f"Error initializing pin {pin_num}: {e}")
+# Initialize IRQ capture for the room buttons and the Button pin
+capture = ButtonCapture([pin_num for pin_num, _ in BUTTON_PINS] + [BTN_PIN_NUM])
 
 async def wifi():
     # Connect to Wi-Fi
@@ -64,7 +66,7 @@ async def wifi():
     asyncio.create_task(wifi_monitor())
 
 # Define the alarm function
-async def set_alarm(room):
+async def set_alarm(room, template=None):
     config = load_config()
     if not config:
         print("Cannot load Wi-Fi credentials from config file.")
@@ -77,33 +79,44 @@ async def set_alarm(room):
     SIREN_PIN.value(1)  # Turn the Siren on
     await alarm_msg(room)
     if not TEST_MODE:
-        await send_alarm_to_mother(room)
+        await send_alarm_to_mother(room, template)
     else:
         await asyncio.sleep(2)
         SIREN_PIN.value(0)
         ALARM_ON = False
-        await send_alarm_to_mother(room)
+        await send_alarm_to_mother(room, template)
         await defaultDisplay()
 
-async def set_mother_alarm():
-    config = load_config()
-    if config is None:
-        print("Failed to load configuration file.")
-        return False
-    if config.get('isMother') == True:
-        # Retrieve the 'mother_alarms' list
-        mother_alarms = config.get('mother_alarms', [])
-        
-        # Find and update the matching alarm
-        for alarm in mother_alarms:
-            if alarm.get('ring') == True:
-                global ALARM_ON
-                ALARM_ON = True
-                SIREN_PIN.value(1)  # Turn the Siren on
-                await mother_alarm_msg(alarm.get('block_name'), alarm.get('room'))
-                break
+# Runs set_alarm concurrently per room and coalesces repeat presses
+dispatcher = AlarmDispatcher(set_alarm)
 
-     
+async def show_mother_alarm(alarm):
+    """Keep the ringing alarm on the LCD until the task is cancelled."""
+    while True:
+        await mother_alarm_msg(alarm.get('block_name'), alarm.get('room'))
+
+async def mother_siren():
+    """
+    Sound the siren as soon as a ringing alarm reaches this mother; the
+    alarm handlers and silence() wake this task through a flag. The LCD
+    message runs as its own task, so it never delays the siren, and is
+    cancelled when the alarm is silenced or replaced.
+    """
+    global ALARM_ON
+    display = None
+    shown = None
+    while True:
+        alarm = mother_store.ringing()
+        if alarm is not None:
+            ALARM_ON = True
+            SIREN_PIN.value(1)  # Turn the Siren on
+        if display is not None and alarm is not shown:
+            display.cancel()
+            display = None
+        if alarm is not None and display is None:
+            display = asyncio.create_task(show_mother_alarm(alarm))
+            shown = alarm
+        await mother_store.siren_flag.wait()
 
 def server_check():
     if srv is None:
@@ -113,24 +126,10 @@ def server_check():
 def reset():
     global ALARM_ON
     ALARM_ON = False
+    dispatcher.acknowledge_all()
     reset_mother()
     asyncio.create_task(defaultDisplay())
 
-        
-async def set_mother_alarm_loop():
-    while True:
-        if BTN_PIN.value() == 0:
-            SIREN_PIN.value(0)
-            print(ALARM_ON)
-            if not ALARM_ON:
-                await view_connection()
-            else:
-                await defaultDisplay()
-                reset()
-                    
-        await set_mother_alarm()
-        await asyncio.sleep(0.5)
-
 
         
 async def start_socket_server():
@@ -155,18 +154,30 @@ async def start_socket_server():
         print("Failed to start socket server:", e)        
 
 
-async def handle_button_press(pin_num):
-    config = load_config()
-    number_of_rooms_str = config.get('number_of_rooms', '')
-    
-    number_of_rooms = number_of_rooms_str.split(',')
-    room_index = None
-    for index, (pin, _) in enumerate(BUTTON_PINS):
-        if pin == pin_num:
-            room_index = index
-            break
-    
-    if room_index is not None:
+def on_button_event(pin_num, ticks):
+    """Dispatch a captured press (called from the capture task)."""
+    if pin_num == BTN_PIN_NUM:
+        # Independent listener for BTN_PIN
+        SIREN_PIN.value(0)
+        print(ALARM_ON)
+        if not ALARM_ON:
+            asyncio.create_task(view_connection())
+        else:
+            reset()
+    else:
+        handle_button_press(pin_num)
+
+
+# Pin -> (room label, alarm payload template), rebuilt when the config changes
+_room_table = {}
+_room_table_gen = None
+
+def build_room_table(device):
+    """Resolve the room label and alarm payload template of every button pin."""
+    number_of_rooms = device['rooms']
+    block_name = device['block_name']
+    table = {}
+    for room_index, (pin_num, _) in enumerate(BUTTON_PINS):
         # Check if room_index is within the bounds of number_of_rooms
         if room_index < len(number_of_rooms):
             dynamic_room_label = number_of_rooms[room_index]  # e.g., 'R7'
@@ -175,13 +186,26 @@ async def handle_button_press(pin_num):
             # If not enough room labels, default to "Room Unknown"
             display_message_str = "Room Unknown"
             print(f"No room label available for button pin {pin_num} at index {room_index}")
-    else:
+        template = {"block_name": block_name, "room": display_message_str}
+        table[pin_num] = (display_message_str, template)
+    return table
+
+def handle_button_press(pin_num):
+    global _room_table, _room_table_gen
+    generation = config_generation()
+    if generation != _room_table_gen:
+        # Room configuration was saved (AP form, /api/config or BLE)
+        _room_table = build_room_table(get_identity())
+        _room_table_gen = generation
+
+    entry = _room_table.get(pin_num)
+    if entry is None:
         # If button pin not found in BUTTON_PINS
-        display_message_str = "Room Unknown"
         print(f"Button pin {pin_num} not found in BUTTON_PINS")
-    
-    # Trigger alarm with dynamic room label
-    asyncio.create_task(set_alarm(display_message_str))
+        entry = ("Room Unknown", None)
+
+    # Trigger alarm with dynamic room label (repeat presses are coalesced)
+    dispatcher.press(entry[0], entry[1])
 
  
 async def main():
@@ -189,7 +213,8 @@ async def main():
     check_free_space()
     connect_to_wifi()
     
-    srv = server.start_server()
+    global srv
+    srv = await server.start_server()
     asyncio.create_task(defaultDisplay())
 
     # Start the Access Point
@@ -199,6 +224,9 @@ async def main():
     # Schedule the socket server
     asyncio.create_task(start_socket_server())
 
+    # Coalesce configuration writes into one flash write per window
+    asyncio.create_task(config_writer())
+
     # Sync time every 1Hr
     asyncio.create_task(periodic_time_sync())
     
@@ -207,37 +235,47 @@ async def main():
     if config is None:
         print("Failed to load configuration file.")
         return False
+
+    # Move any alarm history still kept in the config into the journals
+    if migrate_from_config(config):
+        save_config(config)
+
+    # Keep the alarm journals within the retention policy
+    asyncio.create_task(compaction_loop())
+
+    # Persist alarms received from children in batches
+    asyncio.create_task(mother_store.flush_loop())
+
+    # Window for coalescing repeat presses of the same room
+    dispatcher.window_ms = int(config.get('alarm_coalesce_ms', DEFAULT_COALESCE_MS))
     if config.get('isMother') == True:
-        asyncio.create_task(set_mother_alarm_loop())
+        mother_store.restore()
+        asyncio.create_task(mother_siren())
+        # Optional UDP fast path for alarms from children
+        if config.get('udp_alarms') and get_ip():
+            asyncio.create_task(udp_alarm.mother_listener(mother_store.ingest, get_ip()))
     
-    # Start periodic pinging every hour
-    asyncio.create_task(periodic_ping())
+    # Resolve the button rooms once at boot
+    global _room_table, _room_table_gen
+    _room_table = build_room_table(get_identity())
+    _room_table_gen = config_generation()
+
+    # Retry undelivered mother alarms in the background
+    asyncio.create_task(outbox.outbox_worker(redeliver_to_mother))
+
+    # Ping the cloud and upload alarms as they are recorded
+    asyncio.create_task(cloud_scheduler())
     
     print("Waiting for button presses...")
-    while True:
-        # Iterate over each button to check for presses
-        for pin_num, _ in BUTTON_PINS:
-            if buttons[pin_num].value() == 0:  # Button pressed (active low)
-                asyncio.create_task(handle_button_press(pin_num))
-                await asyncio.sleep(1)  
-                break  # Exit loop to avoid multiple alarms at once
-       
-        # Independent listener for BTN_PIN
-        if BTN_PIN.value() == 0:
-            SIREN_PIN.value(0)
-            print(ALARM_ON)
-            if not ALARM_ON:
-                asyncio.create_task(view_connection())
-            else:
-                reset()
-        
-        await asyncio.sleep(0.1)
+    # Presses are captured by IRQs and handled as soon as they are queued
+    await capture.run(on_button_event)
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         print("Exiting program")
-        server.stop_server(srv)
+        if srv:
+            server.stop_server(srv)
         # Add cleanup code if necessary
 
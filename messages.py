@@ -2,7 +2,7 @@
 
 import uasyncio as asyncio
 from lcd_utils import *
-import ujson
+from utils import load_config
 
 # Create a lock for the LCD to prevent concurrent access
 lcd_lock = asyncio.Lock()
@@ -32,17 +32,22 @@ async def mother_alarm_msg(block, room):
     task2 = asyncio.create_task(display_message(f"Block: {block} Room: {room}", line=1, display_time=10))
 
     # Wait for both tasks to complete
-    await asyncio.gather(task1, task2)
+    try:
+        await asyncio.gather(task1, task2)
+    except asyncio.CancelledError:
+        # The alarm was silenced or replaced: stop both lines now
+        task1.cancel()
+        task2.cancel()
+        raise
         
 async def view_connection():
     print("In display")
     try:
-        # Read Wi-Fi configuration file
-        with open('wifi_config.json', 'r') as f:
-            credentials = ujson.load(f)
-            ip_address = credentials.get('ip_address')
-            ssid = credentials.get('ssid')
-            password = credentials.get('password')
+        # Read Wi-Fi configuration
+        credentials = load_config()
+        ip_address = credentials.get('ip_address')
+        ssid = credentials.get('ssid')
+        password = credentials.get('password')
 
         # Create asynchronous tasks for the two messages
         dis_task1 = asyncio.create_task(display_message(f"IP: {ip_address}", scroll_time=0.5, display_time=15, clear_before=True))
@@ -61,14 +66,13 @@ async def view_connection():
 async def defaultDisplay():
     print("In display")
     try:
-        # Read Wi-Fi configuration file
-        with open('wifi_config.json', 'r') as f:
-            credentials = ujson.load(f)
-            block_name = credentials.get('block_name')
-            number_of_rooms = credentials.get('number_of_rooms')
-            isMother = credentials.get('isMother')
-            center_name = credentials.get('center_name')
-            ip_address = credentials.get('ip_address')
+        # Read Wi-Fi configuration
+        credentials = load_config()
+        block_name = credentials.get('block_name')
+        number_of_rooms = credentials.get('number_of_rooms')
+        isMother = credentials.get('isMother')
+        center_name = credentials.get('center_name')
+        ip_address = credentials.get('ip_address')
 
         # Create asynchronous tasks for the two messages
         if not isMother:
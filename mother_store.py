@@ -0,0 +1,188 @@
+# mother_store.py
+
+import ujson
+import uasyncio as asyncio
+from alarm_log import mother_journal
+
+# Alarms arriving within this window are written to the journal together
+FLUSH_DELAY_MS = 200
+
+# References remembered for duplicate detection
+RECENT_REFERENCES = 64
+
+
+class ReferenceIndex:
+    """
+    Bounded LRU map from alarm reference to the acknowledgement sent for it.
+
+    Every lookup or insert appends (reference, touch) to an order list; the
+    least recently used reference is found by skipping order entries that
+    were superseded by a later touch. Both operations are O(1) amortized.
+    """
+
+    def __init__(self, capacity=RECENT_REFERENCES):
+        self.capacity = capacity
+        self.hits = 0
+        self._entries = {}  # reference -> [ack, last touch]
+        self._order = []    # (reference, touch), oldest first from _head
+        self._head = 0
+        self._touch = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _touched(self, reference, entry):
+        self._touch += 1
+        entry[1] = self._touch
+        self._order.append((reference, self._touch))
+        if len(self._order) > 4 * self.capacity:
+            # Drop consumed and superseded order entries
+            self._order = [item for item in self._order[self._head:]
+                           if self._entries.get(item[0], (None, -1))[1] == item[1]]
+            self._head = 0
+
+    def get(self, reference):
+        """Return the acknowledgement for a known reference, or None."""
+        entry = self._entries.get(reference)
+        if entry is None:
+            return None
+        self.hits += 1
+        self._touched(reference, entry)
+        return entry[0]
+
+    def put(self, reference, ack):
+        """Remember a reference, evicting the least recently used one if full."""
+        entry = [ack, 0]
+        self._entries[reference] = entry
+        self._touched(reference, entry)
+        while len(self._entries) > self.capacity:
+            ref, touch = self._order[self._head]
+            self._head += 1
+            oldest = self._entries.get(ref)
+            if oldest is not None and oldest[1] == touch:
+                del self._entries[ref]
+
+
+# Alarms acknowledged to children but not yet in the journal
+_queue = []
+# Acknowledgements of recently received alarms, by reference
+references = ReferenceIndex()
+# Oldest alarm that should ring and has not been silenced, or None
+_ringing = None
+
+# The HTTP server, the UDP listener and the flush and siren tasks all run
+# on the event loop, so the queue needs no lock. ThreadSafeFlag is used for
+# its auto-clearing wait.
+_flush_flag = asyncio.ThreadSafeFlag()
+# Wakes the siren task as soon as a ringing alarm arrives or is silenced
+siren_flag = asyncio.ThreadSafeFlag()
+
+
+def _make_entry(data):
+    mode = data.get('mode')
+    return {
+        'block_name': data.get('block_name'),
+        'room': data.get('room'),
+        'date': data.get('date'),
+        'reference': data.get('reference'),
+        # Alarms raised in maintenance mode are logged but do not ring
+        'ring': mode != "Maintenance",
+        'mode': mode
+    }
+
+
+def _ack(reference):
+    return ujson.dumps({'message': 'Alarm received and saved successfully',
+                        'reference': reference})
+
+
+def ingest(data):
+    """
+    Accept an alarm from a child unit, over HTTP or UDP, and return the JSON
+    acknowledgement. A repeated reference (a child retrying an alarm that
+    already arrived) gets the original acknowledgement and changes nothing.
+    The alarm is persisted by flush_loop shortly afterwards.
+    """
+    global _ringing
+    reference = data.get('reference')
+    if reference:
+        ack = references.get(reference)
+        if ack is not None:
+            return ack
+        ack = _ack(reference)
+        references.put(reference, ack)
+    else:
+        ack = _ack(None)
+    entry = _make_entry(data)
+    _queue.append(entry)
+    if entry['ring'] and _ringing is None:
+        _ringing = entry
+        siren_flag.set()
+    _flush_flag.set()
+    return ack
+
+
+def ringing():
+    """Return the alarm the siren should announce, or None."""
+    return _ringing
+
+
+def silence():
+    """
+    Stop ringing for every alarm silenced in the journal. Alarms that are
+    still queued were received after the journal was settled and keep ringing.
+    """
+    global _ringing
+    _ringing = None
+    for alarm in _queue:
+        if alarm['ring']:
+            _ringing = alarm
+            break
+    # Let the siren task stop the display or announce the next alarm
+    siren_flag.set()
+
+
+def restore():
+    """Recover the ring state from the journal after a reboot."""
+    global _ringing
+    for _, alarm in mother_journal.pending():
+        if alarm.get('ring') == True:
+            _ringing = alarm
+            siren_flag.set()
+            break
+
+
+def queued():
+    """Return a snapshot of the alarms not yet written to the journal."""
+    return _queue[:]
+
+
+def flush():
+    """
+    Write the queued alarms to the journal in one append. Returns the number
+    written, or None if the write failed and the alarms are still queued.
+    """
+    if not _queue:
+        return 0
+    batch = _queue[:]
+    del _queue[:]
+    try:
+        mother_journal.extend(batch)
+    except Exception as e:
+        print("Error updating mother alarm journal:", e)
+        _queue[0:0] = batch  # Keep them for the next flush
+        return None
+    print(f"{len(batch)} alarm(s) added to the mother alarm journal.")
+    return len(batch)
+
+
+async def flush_loop(delay_ms=FLUSH_DELAY_MS):
+    """Persist ingested alarms in batches, shortly after they arrive."""
+    while True:
+        await _flush_flag.wait()
+        # Let the rest of a burst arrive before writing
+        await asyncio.sleep_ms(delay_ms)
+        if flush() is None:
+            # Storage error: retry later rather than on every request
+            await asyncio.sleep(5)
+            _flush_flag.set()
@@ -2,6 +2,19 @@ import urequests
 import os
 import ujson  # Import ujson for JSON handling
 import machine  # Import machine module for resetting the ESP32
+import ubinascii
+try:
+    import uhashlib as hashlib
+except ImportError:
+    import hashlib
+from identity import firmware_changed
+from utils import ETAG_FILE, write_file_atomic
+
+
+def content_hash(data):
+    """Short SHA-256 of a file's contents, used as its HTTP ETag."""
+    return ubinascii.hexlify(hashlib.sha256(data).digest())[:16].decode()
+
 
 class OTAUpdater:
     def __init__(self, ssid, password, firmware_url):
@@ -50,10 +63,25 @@ class OTAUpdater:
         try:
             with open("version.json", "w") as f:
                 ujson.dump({"version": version}, f)
+            firmware_changed()
         except Exception as e:
             print(f"Error updating local version.json: {e}")
 
+    def _save_etags(self, etags):
+        """Merge the hashes of newly installed files into the ETag manifest."""
+        try:
+            with open(ETAG_FILE, "r") as f:
+                manifest = ujson.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        manifest.update(etags)
+        try:
+            write_file_atomic(ETAG_FILE, ujson.dumps(manifest))
+        except Exception as e:
+            print(f"Error writing {ETAG_FILE}: {e}")
+
     def _update_files(self, files):
+        etags = {}
         for file in files:
             print(f"Updating {file}...")
             try:
@@ -70,11 +98,17 @@ class OTAUpdater:
                 # Fetch the file from the repository
                 response = urequests.get(f"{self.firmware_url}/{file}")
                 if response.status_code == 200:
-                    # Write the file contents to the local file system
-                    with open(file, "w") as f:
-                        f.write(response.text)
+                    # Write the file contents to the local file system. Bytes are
+                    # written as received, so precompressed .gz assets survive.
+                    content = response.content
+                    with open(file, "wb") as f:
+                        f.write(content)
+                    # Hash now, while the contents are in memory
+                    etags[file] = content_hash(content)
                     print(f"{file} updated successfully.")
                 else:
                     print(f"Failed to download {file}: {response.status_code}")
             except Exception as e:
-                print(f"Error updating {file}: {e}")
\ No newline at end of file
+                print(f"Error updating {file}: {e}")
+        if etags:
+            self._save_etags(etags)
\ No newline at end of file
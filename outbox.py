@@ -0,0 +1,141 @@
+# outbox.py
+
+import ujson
+import urandom
+import time
+import uasyncio as asyncio
+from utils import write_file_atomic
+
+# Undelivered mother alarms, persisted so they survive a reboot
+OUTBOX_FILE = "outbox.json"
+MAX_ENTRIES = 50
+# Queued alarms older than this (seconds) are dropped instead of delivered,
+# so a mother that comes back late does not ring for a stale emergency
+MAX_AGE = 600
+
+# Per-destination retry backoff in seconds
+BACKOFF_BASE = 2
+BACKOFF_MAX = 60
+
+# Pending deliveries: list of {"ip": ..., "payload": <json string>,
+# "queued": wall-clock seconds or None if the clock was not set}
+_entries = None
+# ip -> [failed attempts, ticks_ms when the destination is due again]
+_backoff = {}
+_wakeup = asyncio.Event()
+
+
+def _load():
+    global _entries
+    if _entries is None:
+        try:
+            with open(OUTBOX_FILE, 'r') as f:
+                _entries = ujson.load(f)
+        except (OSError, ValueError):
+            _entries = []
+    return _entries
+
+
+def _persist():
+    try:
+        write_file_atomic(OUTBOX_FILE, ujson.dumps(_entries))
+    except Exception as e:
+        print(f"Error writing outbox: {e}")
+
+
+def _now_s():
+    """Return wall-clock seconds, or None until NTP or the RTC has set the clock."""
+    if time.localtime()[0] < 2024:
+        return None
+    return time.time()
+
+
+def enqueue(ip, payload_str):
+    """Queue an alarm payload for redelivery to a mother."""
+    entries = _load()
+    entries.append({"ip": ip, "payload": payload_str, "queued": _now_s()})
+    if len(entries) > MAX_ENTRIES:
+        dropped = entries.pop(0)
+        print(f"Outbox full, dropped alarm for {dropped['ip']}")
+    _persist()
+    print(f"Queued alarm for redelivery to {ip}")
+    _wakeup.set()
+
+
+def mark_reachable(ip):
+    """A delivery to ip just succeeded: retry its queued alarms right away."""
+    if ip in _backoff:
+        del _backoff[ip]
+        _wakeup.set()
+
+
+def _delay_ms(attempts):
+    """Exponential backoff with up to 50% random jitter."""
+    delay = min(BACKOFF_BASE * (1 << min(attempts - 1, 10)), BACKOFF_MAX) * 1000
+    return delay + urandom.getrandbits(16) % (delay // 2 + 1)
+
+
+def _drop_expired():
+    """Drop alarms that have waited longer than MAX_AGE."""
+    now = _now_s()
+    if now is None:
+        return
+    expired = [entry for entry in _entries
+               if entry.get("queued") is not None and now - entry["queued"] > MAX_AGE]
+    for entry in expired:
+        _entries.remove(entry)
+        print(f"Dropped expired alarm for {entry['ip']}")
+    if expired:
+        _persist()
+
+
+def _due(ip, now):
+    state = _backoff.get(ip)
+    return state is None or time.ticks_diff(now, state[1]) >= 0
+
+
+def _next_wait_ms(now):
+    """Milliseconds until the next destination is due, or None if the queue is empty."""
+    wait = None
+    for entry in _entries:
+        state = _backoff.get(entry["ip"])
+        remaining = 0 if state is None else max(0, time.ticks_diff(state[1], now))
+        if wait is None or remaining < wait:
+            wait = remaining
+    return wait
+
+
+async def outbox_worker(send):
+    """
+    Drain the outbox in the background. send(ip, payload_str) must return
+    True once the mother has accepted the alarm. A failing destination is
+    backed off on its own, so other mothers keep being served.
+    """
+    _load()
+    while True:
+        _drop_expired()
+        wait = _next_wait_ms(time.ticks_ms())
+        _wakeup.clear()
+        if wait is None or wait > 0:
+            try:
+                if wait is None:
+                    await _wakeup.wait()
+                else:
+                    await asyncio.wait_for_ms(_wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        now = time.ticks_ms()
+        for entry in _entries[:]:
+            ip = entry["ip"]
+            if not _due(ip, now):
+                continue
+            if await send(ip, entry["payload"]):
+                _entries.remove(entry)
+                _persist()
+                _backoff.pop(ip, None)
+                print(f"Redelivered queued alarm to {ip}")
+            else:
+                attempts = _backoff[ip][0] + 1 if ip in _backoff else 1
+                _backoff[ip] = [attempts, time.ticks_add(time.ticks_ms(), _delay_ms(attempts))]
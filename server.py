@@ -7,20 +7,22 @@ from MicroWebSrv.microWebSrv import MicroWebSrv
 import uasyncio as asyncio
 from wifi_connect import get_ip
 from utils import *
+import mother_store
 
 server_instance = None
 
 # Define a GET route handler for the configuration
 def config_get_handler(httpClient, httpResponse):
     try:
-        with open('wifi_config.json', 'r') as f:
-            config = f.read()
+        config = load_config()
+        if not config:
+            raise ValueError("configuration unavailable")
         # Return the config as JSON
         httpResponse.WriteResponseOk(
             headers=None,
             contentType="application/json",
             contentCharset="UTF-8",
-            content=config
+            content=ujson.dumps(config)
         )
     except Exception as e:
         print("Error reading config file:", e)
@@ -33,9 +35,8 @@ def config_put_handler(httpClient, httpResponse):
     print(content)
     if content:
         try:
-            # Write the content back to the config file
-            with open('wifi_config.json', 'w') as f:
-                ujson.dump(content, f)
+            # Write the content back to the config file (refreshes the cache)
+            save_config(content)
             httpResponse.WriteResponseOk(
                 headers=None,
                 contentType="application/json",
@@ -50,70 +51,36 @@ def config_put_handler(httpClient, httpResponse):
         httpResponse.WriteResponseBadRequest({"error": "Invalid JSON data in request."})
         
 
-# Define the POST route handler for '/mother/alarm'
+# Define the PUT route handler for '/api/mother/alarm'
 def mother_alarm_handler(httpClient, httpResponse):
     # Read the JSON data from the request
     data = httpClient.ReadRequestContentAsJSON()
     if data:
         block_name = data.get('block_name')
         room = data.get('room')
-        date = data.get('date')
-        reference = data.get('reference')
-        mode = data.get('mode')
 
         if block_name and room:
             print(f"Received alarm from Block: {block_name}, Room: {room}")
 
-            # Load the existing config
-            config = load_config()
-            if config is None:
-                # Handle error if config cannot be loaded
-                response_data = {'error': 'Failed to load configuration file.'}
-                httpResponse.WriteResponseInternalServerError(obj=response_data)
-                return
-
-            # Initialize 'mother_alarms' as a list if it doesn't exist
-            if 'mother_alarms' not in config or not isinstance(config['mother_alarms'], list):
-                config['mother_alarms'] = []
-
-            # Determine the value of 'ring' based on the mode
-            ring = False if mode == "Maintenance" else True
-
-            # Create the new alarm entry
-            new_alarm = {
-                'block_name': block_name,
-                'room': room,
-                'date': date,
-                'reference': reference,
-                'ring': ring,
-                'mode': mode
-            }
-
-            # Append the new alarm to the list
-            config['mother_alarms'].append(new_alarm)
-
-            # Save the updated config back to the file
-            try:
-                save_config(config)
-                print("New alarm added to 'mother_alarms' in config file.")
-                # Send a success response
-                response_data = {'message': 'Alarm received and saved successfully'}
-                httpResponse.WriteResponseJSONOk(obj=response_data)
-            except Exception as e:
-                print("Error updating config file:", e)
-                response_data = {'error': 'Failed to update configuration file.'}
-                httpResponse.WriteResponseInternalServerError(obj=response_data)
+            # Queue the alarm and acknowledge at once; it is persisted in the
+            # background. A retried alarm gets its original acknowledgement.
+            httpResponse.WriteResponseOk(
+                headers=None,
+                contentType="application/json",
+                contentCharset="UTF-8",
+                content=mother_store.ingest(data)
+            )
         else:
             # Missing 'block_name' or 'room' in the data
             response_data = {'error': 'Missing "block_name" or "room" in request data'}
-            httpResponse.WriteResponseBadRequest(obj=response_data)
+            httpResponse.WriteResponseJSONError(400, obj=response_data)
     else:
         # Invalid or missing JSON data
         response_data = {'error': 'Invalid or missing JSON data'}
-        httpResponse.WriteResponseBadRequest(obj=response_data)    
+        httpResponse.WriteResponseJSONError(400, obj=response_data)
 
-# Function to start the server
-def start_server():
+# Function to start the server on the running event loop
+async def start_server():
     global server_instance
     config = load_config()
     
@@ -145,8 +112,15 @@ def start_server():
         ("/api/config", "PUT", config_put_handler),
         ("/api/mother/alarm", "PUT", mother_alarm_handler)
     ]
-    srv = MicroWebSrv(routeHandlers=routeHandlers)
-    srv.Start(threaded=True)
+    # Web assets live where OTA installs them, so their paths match the
+    # keys of the ETag manifest
+    srv = MicroWebSrv(routeHandlers=routeHandlers, webPath="/www")
+    # Let children reuse their connection for bursts of alarms
+    srv.KeepAlive = True
+    # Static files are revalidated against the hashes recorded by OTA updates
+    srv.ETagManifest = ETAG_FILE
+    # Serve on the shared event loop, alongside the access point portal
+    await srv.StartAsync()
 
     print(f"Server started! Access GET endpoint at http://{ip_address}/api/config")
     print(f"Server started! Access PUT endpoint at http://{ip_address}/api/config")
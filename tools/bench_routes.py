@@ -0,0 +1,135 @@
+# bench_routes.py
+#
+# Measures the per-request cost of MicroWebSrv route dispatch as the number
+# of registered routes grows, comparing the compiled dispatcher
+# (GetRouteHandler) with the old linear regex scan. Runs on a PC with
+# CPython 3 or on the device with MicroPython:
+#
+#   python3 tools/bench_routes.py
+#
+# Every lookup is also checked against the linear scan, so the benchmark
+# doubles as a consistency test of the dispatcher.
+
+import sys
+
+sys.path.append('MicroWebSrv')
+sys.path.append('../MicroWebSrv')
+
+from microWebSrv import MicroWebSrv
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    from time import perf_counter
+
+    def ticks_us():
+        return int(perf_counter() * 1000000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+
+ROUTE_COUNTS = (8, 32, 128, 512)
+ROUNDS = 2000
+
+
+def _make_handler():
+    # A distinct function per route, so the consistency checks see which
+    # route was picked
+    def handler(client, response, args=None):
+        pass
+    return handler
+
+
+def make_routes(count):
+    """Half static routes, half parameterized, like a typical API."""
+    routes = [('/api/(v1|v2)/status', 'GET', _make_handler())]
+    for i in range(count // 2):
+        routes.append(('/api/item%d' % i, 'GET', _make_handler()))
+        routes.append(('/api/item%d/<id>/field/<name>' % i, 'POST', _make_handler()))
+    return routes
+
+
+# Overlapping routes: the first registered match must win, whatever kind
+# of route it is
+PRECEDENCE_ROUTES = [
+    ('/a/[a-z]+', 'GET', _make_handler()),
+    ('/a/x', 'GET', _make_handler()),
+    ('/u/<id>', 'GET', _make_handler()),
+    ('/u/me', 'GET', _make_handler()),
+    ('/p/<a>/c', 'GET', _make_handler()),
+    ('/p/x/<b>', 'GET', _make_handler()),
+    ('/q/x', 'GET', _make_handler()),
+    ('/q/<id>', 'GET', _make_handler()),
+    ('/r/<id>', 'GET', _make_handler()),
+    ('/r/[0-9]+', 'GET', _make_handler()),
+]
+PRECEDENCE_REQUESTS = [
+    ('/a/x', 'GET'), ('/a/y', 'GET'), ('/u/me', 'GET'), ('/u/7', 'GET'),
+    ('/p/x/c', 'GET'), ('/p/x/d', 'GET'), ('/q/x', 'GET'), ('/q/y', 'GET'),
+    ('/r/12', 'GET'), ('/r/ab', 'GET'), ('/', 'GET'),
+]
+
+
+def make_requests(count):
+    last = count // 2 - 1
+    return [
+        ('/api/item%d' % last, 'GET'),              # last static route
+        ('/api/item%d/' % (last // 2), 'GET'),      # trailing slash
+        ('/api/item%d/42/field/x' % last, 'POST'),  # last parameterized route
+        ('/api/missing', 'GET'),                    # no match
+        ('/api/v2/status', 'GET'),                  # regex route
+    ]
+
+
+def linear_lookup(srv, resUrl, method):
+    """The dispatch GetRouteHandler used to do: one regex per route."""
+    if resUrl.endswith('/'):
+        resUrl = resUrl[:-1]
+    method = method.upper()
+    for rh in srv._routeHandlers:
+        if rh.method == method:
+            m = rh.routeRegex.match(resUrl)
+            if m:
+                if rh.routeArgNames:
+                    routeArgs = {}
+                    for i, name in enumerate(rh.routeArgNames):
+                        value = m.group(i + 1)
+                        try:
+                            value = int(value)
+                        except ValueError:
+                            pass
+                        routeArgs[name] = value
+                    return (rh.func, routeArgs)
+                return (rh.func, None)
+    return (None, None)
+
+
+def time_per_lookup(lookup, requests):
+    start = ticks_us()
+    for _ in range(ROUNDS):
+        for url, method in requests:
+            lookup(url, method)
+    return ticks_diff(ticks_us(), start) / (ROUNDS * len(requests))
+
+
+def check(srv, requests):
+    for url, method in requests:
+        expected = linear_lookup(srv, url, method)
+        assert srv.GetRouteHandler(url, method) == expected, (url, method)
+
+
+def main():
+    check(MicroWebSrv(routeHandlers=PRECEDENCE_ROUTES), PRECEDENCE_REQUESTS)
+    print('%8s %14s %14s %8s' % ('routes', 'linear (us)', 'compiled (us)', 'speedup'))
+    for count in ROUTE_COUNTS:
+        srv = MicroWebSrv(routeHandlers=make_routes(count))
+        requests = make_requests(count)
+        check(srv, requests)
+        linear = time_per_lookup(lambda url, method: linear_lookup(srv, url, method), requests)
+        compiled = time_per_lookup(srv.GetRouteHandler, requests)
+        print('%8d %14.2f %14.2f %7.1fx' % (count, linear, compiled, linear / compiled))
+
+
+if __name__ == '__main__':
+    main()
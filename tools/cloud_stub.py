@@ -0,0 +1,114 @@
+# cloud_stub.py
+#
+# Local stand-in for the cloud API, for testing pings and alarm uploads
+# without the real server. Runs on a PC with CPython 3:
+#
+#   python3 tools/cloud_stub.py --port 8080
+#
+# then point the device at it by setting in wifi_config.json:
+#
+#   "cloud_base_url": "http://<pc-ip>:8080"
+#
+# Both upload encodings are accepted. The stub advertises the columnar
+# encoding through the X-Alarm-Encoding header, so the device switches to
+# it after its first sync. Start it with --legacy to behave like a server
+# that only understands plain JSON and rejects columnar uploads.
+
+import argparse
+import json
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+ENCODING_HEADER = "X-Alarm-Encoding"
+COLUMNAR = "columnar"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def decode_columnar(body):
+    """Turn a columnar upload back into a list of alarm records."""
+    times = body.get("alarmTime")
+    if times is None:
+        t0 = datetime.strptime(body["t0"], TIME_FORMAT)
+        times = [(t0 + timedelta(seconds=dt)).strftime(TIME_FORMAT) for dt in body["dt"]]
+    alarms = []
+    for i, reference in enumerate(body["reference"]):
+        alarms.append({
+            "roomName": body["rooms"][body["room"][i]],
+            "alarmTime": times[i],
+            "reference": reference,
+            "isSent": "true" if body["isSent"][i] else "false",
+            "mode": body["modes"][body["mode"][i]],
+            "synced": "false"
+        })
+    return alarms
+
+
+class CloudHandler(BaseHTTPRequestHandler):
+    legacy = False
+    received = []  # Every alarm record uploaded so far
+
+    def _reply(self, status, payload, advertise=False):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if advertise and not self.legacy:
+            self.send_header(ENCODING_HEADER, COLUMNAR)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def do_PUT(self):
+        body = self._body()
+        if self.path.split("?")[0].endswith("/ping"):
+            print(f"Ping: {body.decode()}")
+            self._reply(200, {"status": "ok"})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        raw = self._body()
+        if not self.path.split("?")[0].endswith("/sync-emergencies"):
+            self._reply(404, {"error": "not found"})
+            return
+        encoding = self.headers.get(ENCODING_HEADER)
+        if encoding == COLUMNAR and self.legacy:
+            self._reply(415, {"error": "unsupported encoding"})
+            return
+        try:
+            body = json.loads(raw)
+            alarms = decode_columnar(body) if encoding == COLUMNAR else body
+        except (ValueError, KeyError, IndexError) as e:
+            self._reply(400, {"error": str(e)})
+            return
+        plain = len(json.dumps(alarms))
+        print(f"Sync: {len(alarms)} alarms in {len(raw)} bytes "
+              f"({encoding or 'json'}, plain JSON would be {plain} bytes)")
+        for alarm in alarms:
+            print(f"  {alarm}")
+        CloudHandler.received.extend(alarms)
+        self._reply(200, [alarm["reference"] for alarm in alarms], advertise=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the alarm cloud API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--legacy", action="store_true",
+                        help="reject columnar uploads like a JSON-only server")
+    args = parser.parse_args()
+    CloudHandler.legacy = args.legacy
+    server = HTTPServer((args.host, args.port), CloudHandler)
+    print(f"Cloud stub listening on {args.host}:{args.port}"
+          f"{' (legacy JSON only)' if args.legacy else ''}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# udp_alarm.py
+
+import usocket as socket
+import ustruct as struct
+import time
+import uasyncio as asyncio
+
+# Multicast group and port shared by child and mother units
+MULTICAST_GROUP = "239.255.42.99"
+UDP_PORT = 5099
+
+# Child side: retransmit until every mother acks or the deadline passes
+RETRANSMIT_MS = 40
+ACK_DEADLINE_MS = 400
+
+# Packet layout: magic, version, type, sequence number, reference, mode,
+# followed by length-prefixed block name, room and date strings.
+MAGIC = b'SA'
+VERSION = 1
+TYPE_ALARM = 1
+TYPE_ACK = 2
+HEADER = ">2sBBH8sB"
+HEADER_SIZE = struct.calcsize(HEADER)
+
+MODES = ("Production", "Maintenance")
+
+_seq = 0
+
+
+def _pack_str(value):
+    data = (value or '').encode('utf-8')[:255]
+    return bytes([len(data)]) + data
+
+
+def encode_alarm(seq, payload):
+    """Encode an alarm payload dict into a datagram."""
+    mode = 1 if payload.get('mode') == "Maintenance" else 0
+    reference = (payload.get('reference') or '').encode()[:8]
+    return struct.pack(HEADER, MAGIC, VERSION, TYPE_ALARM, seq, reference, mode) + \
+        _pack_str(payload.get('block_name')) + \
+        _pack_str(payload.get('room')) + \
+        _pack_str(payload.get('date'))
+
+
+def encode_ack(seq, reference):
+    return struct.pack(HEADER, MAGIC, VERSION, TYPE_ACK, seq, reference, 0)
+
+
+def decode(packet):
+    """Return (type, seq, reference, payload) or None for foreign packets."""
+    if len(packet) < HEADER_SIZE:
+        return None
+    magic, version, kind, seq, reference, mode = struct.unpack(HEADER, packet[:HEADER_SIZE])
+    if magic != MAGIC or version != VERSION:
+        return None
+    payload = None
+    if kind == TYPE_ALARM:
+        # Anything on the port can reach here: reject truncated fields and
+        # invalid UTF-8 rather than raising in the listener
+        try:
+            fields = []
+            pos = HEADER_SIZE
+            for _ in range(3):
+                if pos >= len(packet):
+                    return None
+                size = packet[pos]
+                if pos + 1 + size > len(packet):
+                    return None
+                fields.append(packet[pos + 1:pos + 1 + size].decode('utf-8'))
+                pos += 1 + size
+            payload = {
+                'block_name': fields[0],
+                'room': fields[1],
+                'date': fields[2],
+                'reference': reference.rstrip(b'\x00').decode(),
+                'mode': MODES[mode] if mode < len(MODES) else MODES[0]
+            }
+        except (ValueError, UnicodeError):
+            return None
+    return kind, seq, reference, payload
+
+
+def _make_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    return sock
+
+
+async def send_alarm(payload, mother_ips, group=MULTICAST_GROUP, deadline_ms=ACK_DEADLINE_MS):
+    """
+    Multicast an alarm to all mothers at once, retransmitting until each
+    mother acknowledges it. Returns {ip: latency_ms} for the mothers that did.
+    """
+    global _seq
+    _seq = (_seq + 1) & 0xFFFF
+    seq = _seq
+    packet = encode_alarm(seq, payload)
+    reference = packet[6:14]
+    pending = set(mother_ips)
+    acked = {}
+
+    sock = _make_socket()
+    try:
+        start = time.ticks_ms()
+        next_send = start
+        while pending:
+            now = time.ticks_ms()
+            elapsed = time.ticks_diff(now, start)
+            if elapsed >= deadline_ms:
+                break
+            if time.ticks_diff(now, next_send) >= 0:
+                try:
+                    sock.sendto(packet, (group, UDP_PORT))
+                except OSError as e:
+                    print(f"UDP alarm send failed: {e}")
+                    break
+                next_send = time.ticks_add(now, RETRANSMIT_MS)
+            try:
+                data, addr = sock.recvfrom(64)
+            except OSError:
+                await asyncio.sleep_ms(2)
+                continue
+            message = decode(data)
+            if message and message[0] == TYPE_ACK and message[1] == seq \
+                    and message[2] == reference and addr[0] in pending:
+                pending.discard(addr[0])
+                acked[addr[0]] = time.ticks_diff(time.ticks_ms(), start)
+    finally:
+        sock.close()
+
+    if pending:
+        print(f"No UDP ack from {sorted(pending)}, falling back to HTTP")
+    return acked
+
+
+async def _readable(sock):
+    # Park the task in uasyncio's poll-based I/O queue until a datagram
+    # arrives, so an idle listener takes no CPU time (as StreamReader does)
+    yield asyncio.core._io_queue.queue_read(sock)
+
+
+async def mother_listener(ingest, local_ip, group=MULTICAST_GROUP):
+    """
+    Receive multicast alarms on a mother unit and hand them to
+    ingest(payload), which must ignore repeated references. An alarm is
+    acked only once ingest has accepted it; without the ack the child
+    falls back to HTTP and its outbox.
+    """
+    sock = _make_socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('0.0.0.0', UDP_PORT))
+    try:
+        membership = socket.inet_pton(socket.AF_INET, group) + \
+            socket.inet_pton(socket.AF_INET, local_ip)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    except (AttributeError, OSError) as e:
+        print(f"Could not join multicast group {group}: {e}")
+    print(f"UDP alarm listener on port {UDP_PORT}")
+
+    while True:
+        try:
+            data, addr = sock.recvfrom(512)
+        except OSError:
+            await _readable(sock)
+            continue
+        message = decode(data)
+        if not message or message[0] != TYPE_ALARM:
+            continue
+        kind, seq, reference, payload = message
+        # Same check as the HTTP route
+        if not payload['block_name'] or not payload['room']:
+            print(f"Ignoring UDP alarm from {addr[0]} without block or room")
+            continue
+        try:
+            ingest(payload)
+        except Exception as e:
+            print(f"Error ingesting UDP alarm: {e}")
+            continue
+        try:
+            sock.sendto(encode_ack(seq, reference), addr)
+        except OSError as e:
+            print(f"UDP ack to {addr[0]} failed: {e}")
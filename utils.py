@@ -4,10 +4,15 @@ import urandom
 import machine
 import network
 import binascii
+import uasyncio as asyncio
+from alarm_log import mother_journal
+import mother_store
 
 # Constants
 CONFIG_FILE = "wifi_config.json"
 VERSION_FILE = "version.json"
+# Content hashes of installed files, used by the web server as ETags
+ETAG_FILE = "etags.json"
 
 # Character sets for generating references
 ASCII_LETTERS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
@@ -15,24 +20,114 @@ DIGITS = '0123456789'
 CHARS = ASCII_LETTERS + DIGITS
 
 
+# Previous version of the config file, kept by atomic writes
+CONFIG_BACKUP_FILE = CONFIG_FILE + ".bak"
+
+# In-memory configuration cache. The config file is parsed once and then
+# served from RAM; every write goes through save_config, which refreshes the
+# cache and bumps the generation counter so callers can detect changes.
+_config = None
+_config_generation = 0
+
+# Coalescing writer state: while config_writer runs, save_config only marks
+# the cache dirty and the writer flushes it once per window.
+_config_dirty = False
+_config_writer_active = False
+
+
 def load_config():
-    """Load configuration from the config file."""
-    try:
-        with open(CONFIG_FILE, 'r') as f:
-            return ujson.load(f)
-    except Exception as e:
-        print(f"Error loading configuration: {e}")
-        return {}
+    """
+    Return the cached configuration, parsing the config file on first use.
+    Falls back to the backup copy if the main file is missing or corrupt.
+    The returned dict is shared; mutate it only when followed by save_config.
+    """
+    global _config
+    if _config is None:
+        for path in (CONFIG_FILE, CONFIG_BACKUP_FILE):
+            try:
+                with open(path, 'r') as f:
+                    _config = ujson.load(f)
+                if path != CONFIG_FILE:
+                    print(f"Configuration recovered from {path}")
+                break
+            except Exception as e:
+                print(f"Error loading configuration from {path}: {e}")
+        else:
+            return {}
+    return _config
+
+
+def write_file_atomic(path, data, backup_path=None):
+    """
+    Replace a file without ever leaving a truncated copy behind.
+    The data is written to a temp file first and renamed into place; the
+    previous version is kept at backup_path if given.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+    if backup_path:
+        try:
+            uos.remove(backup_path)
+        except OSError:
+            pass
+        try:
+            uos.rename(path, backup_path)
+        except OSError:
+            pass  # No previous version yet
+    else:
+        try:
+            uos.remove(path)
+        except OSError:
+            pass
+    uos.rename(tmp_path, path)
 
 
-def save_config(config):
-    """Save configuration to the config file."""
+def flush_config():
+    """Write the cached configuration to flash if it has pending changes."""
+    global _config_dirty
+    if not _config_dirty or _config is None:
+        return True
+    _config_dirty = False
     try:
-        with open(CONFIG_FILE, 'w') as f:
-            ujson.dump(config, f)
+        write_file_atomic(CONFIG_FILE, ujson.dumps(_config), CONFIG_BACKUP_FILE)
         print("Configuration file updated.")
+        return True
     except Exception as e:
+        _config_dirty = True
         print(f"Error writing configuration file: {e}")
+        return False
+
+
+def save_config(config):
+    """
+    Save configuration and refresh the in-memory cache. While config_writer
+    is running the flash write is deferred and coalesced with other saves.
+    """
+    global _config, _config_generation, _config_dirty
+    _config = config
+    _config_generation += 1
+    _config_dirty = True
+    if not _config_writer_active:
+        flush_config()
+
+
+async def config_writer(window=0.5):
+    """Flush coalesced configuration changes at most once per window."""
+    global _config_writer_active
+    _config_writer_active = True
+    try:
+        while True:
+            await asyncio.sleep(window)
+            flush_config()
+    finally:
+        _config_writer_active = False
+        flush_config()
+
+
+def config_generation():
+    """Return a counter that changes every time the configuration changes."""
+    return _config_generation
 
 
 def check_free_space():
@@ -52,33 +147,22 @@ def check_free_space():
 
 def reset_mother():
     """
-    Resets the 'ring' status of all mother alarms to False without clearing the list.
+    Silences all mother alarms by moving the journal marker past them.
+    The alarm history itself is kept.
     """
-    config = load_config()
-    if not config:
-        print("Failed to load configuration file.")
-        return False
-
-    if 'mother_alarms' in config and isinstance(config['mother_alarms'], list):
-        updated = False
-        for alarm in config['mother_alarms']:
-            if isinstance(alarm, dict):
-                alarm['ring'] = False
-                updated = True
-
-        if not updated:
-            print("No 'ring' keys found in 'mother_alarms'. No changes made.")
-    else:
-        print("'mother_alarms' not found in configuration or is not a list.")
-        return False
+    # Alarms still queued in memory are silenced too
+    mother_store.flush()
+    if not mother_journal.has_pending():
+        mother_store.silence()
+        print("No ringing mother alarms. No changes made.")
+        return True
 
-    try:
-        save_config(config)
+    if mother_journal.settle_all():
+        mother_store.silence()
         print("'mother_alarms' have been successfully updated.")
         return True
-    except Exception as e:
-        print(f"Error updating configuration file: {e}")
-        return False
+    print("Error updating mother alarm journal.")
+    return False
 
 
 def gen_reference(length=8):
@@ -100,11 +184,15 @@ def read_internal_temp():
 
 
 def get_mac_address():
-    """Get the MAC address of the device."""
+    """Get the MAC address of the device (use identity.get_identity() for the cached value)."""
     try:
         ap_if = network.WLAN(network.AP_IF)
-        ap_if.active(True)
-        mac = ap_if.config('mac')
+        try:
+            mac = ap_if.config('mac')
+        except OSError:
+            # The interface has to be up before the MAC can be read
+            ap_if.active(True)
+            mac = ap_if.config('mac')
         return binascii.hexlify(mac, ':').decode()
     except Exception as e:
         print(f"Error getting MAC address: {e}")
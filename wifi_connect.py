@@ -1,5 +1,5 @@
 import network
-import ujson
+from utils import load_config
 import time
 import uasyncio as asyncio
 
@@ -7,12 +7,11 @@ wlan = network.WLAN(network.STA_IF)
 
 def connect_to_wifi():
     """
-    Connects to Wi-Fi using credentials from 'wifi_config.json'.
+    Connects to Wi-Fi using credentials from the cached configuration.
     """
     # Load Wi-Fi credentials
     try:
-        with open('wifi_config.json', 'r') as f:
-            credentials = ujson.load(f)
+        credentials = load_config()
         ssid = credentials.get('ssid')
         password = credentials.get('password')
 
@@ -26,6 +26,7 @@ async def wifi_monitor():
             wlan.active(True)
             print("Wi-Fi connection lost. Attempting to reconnect...")
                 # Update the config file with the ip_address
+            config = load_config()
             if config:
                 config['ip_address'] = ""
                 save_config(config)
@@ -36,6 +37,7 @@ async def wifi_monitor():
             max_wait = 15  # seconds
             while max_wait > 0:
                 if wlan.isconnected():
+                    config = load_config()
                     if config:
                         config['ip_address'] = wlan.ifconfig()[0]
                         save_config(config)